@@ -6,7 +6,7 @@ with open("requirements.txt") as f:
     install_requires = f.read().strip().split("\n")
 
 extras_require = {
-    "test": ["pytest"],
+    "test": ["pandas", "pytest"],
     "viz": ["sphinxcontrib-svgbob"],
 }
 extras_require["complete"] = sorted({v for req in extras_require.values() for v in req})
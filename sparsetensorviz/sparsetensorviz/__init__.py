@@ -1,5 +1,8 @@
 from . import _version
-from ._core import SparseTensor
+from ._builder import SparseTensorBuilder
+from ._core import SparseTensor, choose_structure
+from ._memory import trace_construction
+from ._ops import intersect, union
 from .sparsetype import DC, C, S, compressed, doubly_compressed, sparse
 
 __version__ = _version.get_versions()["version"]
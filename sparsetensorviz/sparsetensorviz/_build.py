@@ -0,0 +1,630 @@
+"""Construct level arrays from COO coordinates using only NumPy.
+
+Every structure is derived from the same canonical form: the unique prefixes of the
+lexicographically sorted coordinates.  Level ``i`` of this form holds the unique
+length ``i + 1`` prefixes and pointers into level ``i + 1``, which is exactly the
+"DC-DC-...-DC-S" structure (i.e., CSF).  We call it "csf" below.
+"""
+
+import itertools
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .sparsetype import DC, C, S
+
+# Number of elements per dimension to process at a time so that blocks of all
+# dimensions fit in cache together.
+BLOCKSIZE = 1 << 14
+
+
+# How to combine the values of duplicate coordinates; "first" and "last" are indexed
+DUPLICATES = {
+    "error": None,
+    "sum": np.add,
+    "min": np.minimum,
+    "max": np.maximum,
+    "first": None,
+    "last": None,
+    "count": None,
+}
+
+
+def repeatrange(repeat, *args, dtype=None):
+    """e.g., [0, 1, 2, 0, 1, 2]"""
+    return np.repeat(np.arange(*args, dtype=dtype)[None, :], repeat, axis=0).ravel()
+
+
+def min_uint_dtype(maxval):
+    """The smallest unsigned integer dtype that can hold ``maxval``"""
+    for dtype in [np.uint8, np.uint16, np.uint32]:
+        if maxval <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+
+def level_dtypes(dtype, maxvals, name):
+    if dtype is None:
+        return [min_uint_dtype(maxval) for maxval in maxvals]
+    dtype = np.dtype(dtype)
+    if not np.issubdtype(dtype, np.integer):
+        raise ValueError(f"{name} must be an integer dtype")
+    if maxvals and max(maxvals) > np.iinfo(dtype).max:
+        raise ValueError(f"{name} {dtype} is too small; values up to {max(maxvals)} are needed")
+    return [dtype] * len(maxvals)
+
+
+def validate_coords(arrays, shape=None, *, copy=True):
+    """Validate COO arrays of indices and return them as arrays with the shape.
+
+    ``arrays`` may be a list or tuple of array-likes (including memoryviews) or a
+    single array of shape ``(nnz, ndim)``.
+
+    Everything that can be checked from metadata is checked first.  Then a single
+    pass over cache-sized blocks of all dimensions copies to int (if necessary) and
+    computes the minimum and maximum of each dimension, from which we check bounds
+    or infer the shape.  If ``copy`` is False, integer arrays are used as is.
+    """
+    if isinstance(arrays, (np.ndarray, memoryview)) and np.ndim(arrays) == 2:
+        arrays = list(np.asarray(arrays).T)
+    elif not isinstance(arrays, (list, tuple)):
+        raise TypeError(
+            "arrays argument must be a list or tuple of numpy arrays "
+            "or a 2d array of shape (nnz, ndim)"
+        )
+    if not arrays:
+        raise ValueError("At least one array must be given")
+    arrays = [(array, np.asarray(array)) for array in arrays]
+    if not all(array.ndim == 1 for _, array in arrays):
+        raise ValueError("arrays must be a single dimension")
+    size = arrays[0][1].size
+    if not all(array.size == size for _, array in arrays):
+        raise ValueError("arrays must be the same size")
+    if not all(np.issubdtype(array.dtype, np.integer) for _, array in arrays):
+        raise ValueError("arrays must be integer dtype")
+    if shape is not None:
+        shape = tuple(shape)
+        if not all(dimsize > 0 for dimsize in shape):
+            raise ValueError("Dimension sizes must be greater than 0")
+        if len(shape) != len(arrays):
+            raise ValueError("shape must be the same length as arrays")
+    elif size == 0:
+        raise ValueError("shape must be given if arrays are empty")
+
+    # Copy unless np.asarray already created a new int array (e.g., from a list)
+    inputs = [array for _, array in arrays]
+    outputs = [
+        (
+            array
+            if not copy or array is not orig and array.base is None and array.dtype == int
+            else np.empty(size, int)
+        )
+        for orig, array in arrays
+    ]
+    mins = [0] * len(arrays)
+    maxes = [-1] * len(arrays)
+    for start in range(0, size, BLOCKSIZE):
+        stop = start + BLOCKSIZE
+        for i, (array, out) in enumerate(zip(inputs, outputs)):
+            block = out[start:stop]
+            if out is not array:
+                block[...] = array[start:stop]
+            mins[i] = min(mins[i], block.min())
+            maxes[i] = max(maxes[i], block.max())
+    if min(mins) < 0:
+        raise ValueError("array values must be positive")
+    if shape is None:
+        shape = tuple(int(maxval) + 1 for maxval in maxes)
+    elif not all(maxval < dimsize for maxval, dimsize in zip(maxes, shape)):
+        raise ValueError("index in array is out of bounds")
+    return outputs, shape
+
+
+def validate_values(values, size, *, copy=True):
+    """Validate values and return them as a 1d array.
+
+    A dict of named value arrays is combined into a structured array with one field
+    per name, so all fields may be reordered together in a single gather.
+    """
+    if isinstance(values, dict):
+        if not values:
+            raise ValueError("values dict must not be empty")
+        fields = {name: np.asarray(val) for name, val in values.items()}
+        if not all(val.ndim == 1 and val.size == size for val in fields.values()):
+            raise ValueError("values must be a single dimension the same size as arrays")
+        values = np.empty(size, [(name, val.dtype) for name, val in fields.items()])
+        for name, val in fields.items():
+            values[name] = val
+        return values
+    values = np.array(values) if copy else np.asarray(values)
+    if values.ndim != 1 or values.size != size:
+        raise ValueError("values must be a single dimension the same size as arrays")
+    return values
+
+
+def sort_coords(arrays):
+    """Sort coordinates lexicographically and return the sorted arrays and permutation"""
+    perm = np.lexsort(arrays[::-1])
+    return [array[perm] for array in arrays], perm
+
+
+def transpose_perm(arrays, axes, shape):
+    """Permutation that sorts coordinates by ``axes`` if they are sorted by all axes.
+
+    This is a least significant digit radix sort that does a stable sort of one
+    dimension at a time.  NumPy only counting sorts 8 and 16 bit integers, so wider
+    indices are sorted one 16 bit digit at a time, and each pass is linear time.
+    Passes are skipped where the order is already known:
+
+    - after sorting by ``axes[:j]``, ties are in the current order, so no passes are
+      needed for a suffix of ``axes`` that is increasing
+    - if ``axes`` begins with ``0, 1, ..., k - 1``, those dimensions are replaced by a
+      single pass of the id of each unique length ``k`` prefix
+    """
+    ndim = len(axes)
+    size = arrays[0].size
+    stop = ndim
+    while stop > 0 and (stop == ndim or axes[stop - 1] < axes[stop]):
+        stop -= 1
+    start = 0
+    while start < stop and axes[start] == start:
+        start += 1
+    perm = None
+    for axis in reversed(axes[start:stop]):
+        perm = _radix_pass(perm, arrays[axis], shape[axis] - 1)
+    if perm is not None and start > 0:
+        changed = np.zeros(size, bool)
+        for array in arrays[:start]:
+            changed[1:] |= array[1:] != array[:-1]
+        groups = np.cumsum(changed)
+        perm = _radix_pass(perm, groups, int(groups[-1]) if size else 0)
+    return perm
+
+
+def _radix_pass(perm, key, maxval):
+    """Stable sort ``perm`` (or the identity if None) by ``key`` in 16 bit digits"""
+    shift = 0
+    while shift == 0 or maxval >> shift:
+        digit = (key >> shift) & 0xFFFF if maxval > 0xFFFF else key
+        digit = digit.astype(min_uint_dtype(min(maxval >> shift, 0xFFFF)))
+        if perm is None:
+            perm = np.argsort(digit, kind="stable")
+        else:
+            perm = perm[np.argsort(digit[perm], kind="stable")]
+        shift += 16
+    return perm
+
+
+def sorted_to_csf(arrays, *, check_sorted=False):
+    """Compute the csf levels of lexicographically sorted coordinates.
+
+    This is a single pass per dimension that detects where runs of equal prefixes
+    begin.  Also returns the offsets where each unique coordinate begins, which is
+    shorter than the input if there are duplicates.
+
+    If ``check_sorted`` is True, raise if the coordinates are not sorted.  This is
+    checked in the same pass, since a coordinate is out of order if its first index
+    that differs from the previous coordinate is smaller.
+    """
+    changed = np.zeros(arrays[0].size, bool)
+    changed[:1] = True
+    indices = []
+    pointers = []
+    for array in arrays:
+        nxt = changed.copy()
+        nxt[1:] |= array[1:] != array[:-1]
+        if check_sorted and (~changed[1:] & (array[1:] < array[:-1])).any():
+            raise ValueError("arrays are not sorted lexicographically")
+        starts = np.flatnonzero(nxt)
+        if indices:
+            pointers.append(np.append(np.flatnonzero(changed[starts]), starts.size))
+        indices.append(array[starts].astype(int, copy=False))
+        changed = nxt
+    return indices, pointers, starts
+
+
+def levels_to_csf(indices, pointers):
+    """Compute the csf levels of a tensor from the full levels of any structure.
+
+    Entries of every level are in lexicographic order, so each csf level is found
+    by dropping entries with no coordinates below them and merging consecutive
+    entries with the same prefix, which "S" levels repeat.  This is linear in the
+    size of the levels and doesn't sort or expand to COO.
+    """
+    ndim = len(indices)
+    # Number of coordinates below each entry, from the last level to the first
+    counts = [None] * ndim
+    counts[-1] = np.ones(indices[-1].size, int)
+    for level in reversed(range(ndim - 1)):
+        cumsum = np.concatenate([[0], np.cumsum(counts[level + 1])])
+        ptr = pointers[level].astype(int, copy=False)
+        counts[level] = cumsum[ptr[1:]] - cumsum[ptr[:-1]]
+    csf_indices = []
+    csf_pointers = []
+    prefix_ids = None  # Id of the csf prefix of each entry of the previous level
+    for level in range(ndim):
+        keep = counts[level] > 0
+        index = indices[level][keep].astype(int, copy=False)
+        changed = np.ones(index.size, bool)
+        changed[1:] = index[1:] != index[:-1]
+        if level > 0:
+            ptr = pointers[level - 1]
+            parents = np.repeat(prefix_ids, np.diff(ptr))[keep]
+            changed[1:] |= parents[1:] != parents[:-1]
+            starts = np.flatnonzero(changed)
+            csf_parents = parents[starts]
+            parent_changed = np.ones(starts.size, bool)
+            parent_changed[1:] = csf_parents[1:] != csf_parents[:-1]
+            csf_pointers.append(np.append(np.flatnonzero(parent_changed), starts.size))
+        else:
+            starts = np.flatnonzero(changed)
+        csf_indices.append(index[starts])
+        if level + 1 < ndim:
+            prefix_ids = np.full(keep.size, -1)
+            prefix_ids[keep] = np.cumsum(changed) - 1
+    return csf_indices, csf_pointers
+
+
+def levels_to_coo(indices, pointers, out=None):
+    """Expand the full levels of any structure to COO arrays in lexicographic order.
+
+    Pointers are composed from the last level to the first, so each entry knows the
+    range of coordinates below it and its index is repeated that many times.  If
+    ``out`` arrays are given, each is written in place by scattering the change in
+    index to where each range begins and taking a cumulative sum.
+    """
+    ndim = len(indices)
+    if out is None:
+        out = [None] * ndim
+    leaf_ptr = None
+    for level in reversed(range(ndim)):
+        index = indices[level]
+        if level < ndim - 1:
+            ptr = pointers[level].astype(int, copy=False)
+            leaf_ptr = ptr if leaf_ptr is None else leaf_ptr[ptr]
+        if out[level] is None:
+            index = index.astype(int, copy=False)
+            out[level] = index if leaf_ptr is None else np.repeat(index, np.diff(leaf_ptr))
+        elif leaf_ptr is None:
+            out[level][...] = index
+        else:
+            nonempty = leaf_ptr[:-1] < leaf_ptr[1:]
+            diffs = np.diff(index[nonempty].astype(int), prepend=0)
+            array = out[level]
+            array[...] = 0
+            array[leaf_ptr[:-1][nonempty]] = diffs.astype(array.dtype)
+            np.cumsum(array, out=array)
+    return out
+
+
+def _partition_to_csf(arrays, sort, check_sorted, return_perm):
+    perm = None
+    if sort:
+        arrays, perm = sort_coords(arrays)
+    indices, pointers, starts = sorted_to_csf(arrays, check_sorted=check_sorted)
+    return indices, pointers, starts, perm if return_perm else None
+
+
+def parallel_to_csf(arrays, workers, *, assume_sorted=False, check_sorted=False, return_perm=False):
+    """Compute csf levels in worker processes, partitioned by ranges of the first index.
+
+    Partitions hold disjoint, increasing ranges of the first index, so the csf levels
+    of the partitions may simply be concatenated after offsetting their pointers.
+    The result is identical to ``sorted_to_csf`` of the sorted coordinates.  If
+    ``return_perm`` is True and the coordinates are sorted, also return the
+    permutation that sorts them.
+    """
+    size = arrays[0].size
+    if size == 0:
+        indices, pointers, starts = sorted_to_csf(arrays)
+        return indices, pointers, starts, np.empty(0, int) if return_perm else None
+    # Choose boundaries from a sample of the first index to balance partitions
+    sample = np.sort(arrays[0][:: max(1, size // (1024 * workers))])
+    bounds = np.unique(sample[(np.arange(1, workers) * sample.size) // workers])
+    if assume_sorted:
+        # Empty partitions are dropped
+        offsets = np.unique(np.concatenate([[0], np.searchsorted(arrays[0], bounds), [size]]))
+        parts = [
+            [array[start:stop] for array in arrays]
+            for start, stop in zip(offsets[:-1], offsets[1:])
+        ]
+        if check_sorted and (arrays[0][offsets[1:-1] - 1] >= arrays[0][offsets[1:-1]]).any():
+            raise ValueError("arrays are not sorted lexicographically")
+    else:
+        partition = np.searchsorted(bounds, arrays[0], side="right").astype(np.uint16)
+        # Stable sort of small integers is a radix sort
+        order = np.argsort(partition, kind="stable")
+        offsets = np.unique(np.concatenate([[0], np.cumsum(np.bincount(partition))]))
+        parts = [
+            [array[order[start:stop]] for array in arrays]
+            for start, stop in zip(offsets[:-1], offsets[1:])
+        ]
+        del partition
+    with ProcessPoolExecutor(workers) as executor:
+        results = list(
+            executor.map(
+                _partition_to_csf,
+                parts,
+                [not assume_sorted] * len(parts),
+                [check_sorted] * len(parts),
+                [return_perm] * len(parts),
+            )
+        )
+    del parts
+    perm = None
+    if return_perm and not assume_sorted:
+        perm = np.concatenate(
+            [
+                order[start:stop][result[3]]
+                for start, stop, result in zip(offsets[:-1], offsets[1:], results)
+            ]
+        )
+    indices = [
+        np.concatenate([result[0][level] for result in results]) for level in range(len(arrays))
+    ]
+    pointers = []
+    for level in range(len(arrays) - 1):
+        ptrs = []
+        offset = 0
+        for part_indices, part_pointers, *_ in results:
+            ptrs.append(part_pointers[level][:-1] + offset)
+            offset += part_indices[level + 1].size
+        ptrs.append([offset])
+        pointers.append(np.concatenate(ptrs))
+    starts = np.concatenate([result[2] + start for start, result in zip(offsets[:-1], results)])
+    return indices, pointers, starts, perm
+
+
+def check_duplicates(duplicates):
+    if duplicates not in DUPLICATES:
+        raise ValueError(
+            f"duplicates must be one of {', '.join(map(repr, DUPLICATES))}; got {duplicates!r}"
+        )
+
+
+def combine_duplicates(old, new, how):
+    """Combine the values of coordinates that exist in both ``old`` and ``new``.
+
+    "first" keeps the old values, "last" keeps the new values, and "count" adds
+    counts.  "error" can't combine values and raises.
+    """
+    if how == "error":
+        raise ValueError("Duplicate indices found!")
+    if how == "first":
+        return old
+    if how == "last":
+        return new
+    if old.dtype.names is not None:
+        rv = np.empty(old.size, old.dtype)
+        for name in old.dtype.names:
+            rv[name] = combine_duplicates(old[name], new[name], how)
+        return rv
+    ufunc = np.add if how == "count" else DUPLICATES[how]
+    return ufunc(old, new)
+
+
+def reduce_duplicates(values, starts, size, how):
+    """Combine the values of duplicate coordinates with segmented reductions.
+
+    ``values`` are in sorted order, and ``starts`` are the offsets where each unique
+    coordinate begins, as returned by ``sorted_to_csf``.  The sort is stable, so
+    "first" and "last" follow the order of the input.  "count" ignores ``values``
+    and returns the number of times each coordinate occurs.
+    """
+    if how == "count":
+        return np.diff(np.append(starts, size))
+    if values is None:
+        return None
+    if values.dtype.names is not None:
+        rv = np.empty(starts.size, values.dtype)
+        for name in values.dtype.names:
+            rv[name] = reduce_duplicates(values[name], starts, size, how)
+        return rv
+    if how == "first":
+        return values[starts]
+    if how == "last":
+        return values[np.append(starts[1:], size) - 1]
+    if starts.size == 0:
+        return values[:0]
+    return DUPLICATES[how].reduceat(values, starts)
+
+
+def scatter_reduce(values, keys, size, how):
+    """Reduce values that share keys in ``range(size)`` without sorting.
+
+    Returns the keys that occur in increasing order and their reduced values.  This
+    uses ``np.bincount`` and ``ufunc.at`` on an array of ``size`` items, so ``size``
+    should not be much larger than the number of values.
+    """
+    counts = np.bincount(keys, minlength=size)
+    present = np.flatnonzero(counts)
+    if how == "count":
+        return present, counts[present]
+    if values.dtype.names is not None:
+        rv = np.empty(present.size, values.dtype)
+        for name in values.dtype.names:
+            rv[name] = scatter_reduce(values[name], keys, size, how)[1]
+        return present, rv
+    ufunc = DUPLICATES[how]
+    if how == "sum":
+        out = np.zeros(size, values.dtype)
+    else:
+        # Start from any value of each key, which doesn't change the min or max
+        out = np.empty(size, values.dtype)
+        out[keys] = values
+    ufunc.at(out, keys, values)
+    return present, out[present]
+
+
+class LevelBuilder:
+    """Compute the index and pointers arrays of a structure from csf levels.
+
+    A run of "S" levels followed by a "DC" or "C" level (or the end) forms a group,
+    and every level in a group has the same number of entries:
+
+    - ending in "DC" at level ``k``: one entry per unique length ``k + 1`` prefix
+    - ending in "C" at level ``k`` after "S": unique length ``k`` prefixes times ``shape[k]``
+    - "C" at level ``k`` not after "S": entries of level ``k - 1`` times ``shape[k]``
+    - the final group: one entry per coordinate
+
+    Each level may be computed independently of the others.
+
+    Indices use the smallest unsigned integer dtype that can hold the dimension
+    size, and pointers use the smallest that can hold the size of the next level,
+    unless ``index_dtype`` or ``pointer_dtype`` is given.
+    """
+
+    def __init__(
+        self, csf_indices, csf_pointers, shape, structure, *, index_dtype=None, pointer_dtype=None
+    ):
+        self.csf_indices = csf_indices
+        self.csf_pointers = csf_pointers
+        self.shape = shape
+        self.structure = structure
+        ndim = len(shape)
+        # The final level of the group each level belongs to
+        self.ends = ends = [ndim - 1] * ndim
+        for level in reversed(range(ndim - 1)):
+            ends[level] = ends[level + 1] if structure[level] == S else level
+        sizes = []
+        for level, end in enumerate(ends):
+            if structure[end] != C:
+                size = csf_indices[end].size
+            elif self._after_sparse(end):
+                size = csf_indices[end - 1].size * shape[end]
+            else:
+                size = (sizes[end - 1] if end > 0 else 1) * shape[end]
+            sizes.append(size)
+        self.sizes = sizes
+        self.index_dtypes = level_dtypes(
+            index_dtype, [dimsize - 1 for dimsize in shape], "index_dtype"
+        )
+        self.pointer_dtypes = level_dtypes(pointer_dtype, sizes[1:], "pointer_dtype")
+
+    @property
+    def nbytes(self):
+        """Number of bytes of the index and pointers arrays that need to be stored"""
+        structure = self.structure
+        nbytes = 0
+        for level, sparsity in enumerate(structure):
+            if sparsity != C:
+                nbytes += self.sizes[level] * self.index_dtypes[level].itemsize
+            if level + 1 < len(structure) and sparsity != S and structure[level + 1] != C:
+                nbytes += (self.sizes[level] + 1) * self.pointer_dtypes[level].itemsize
+        return nbytes
+
+    def _after_sparse(self, level):
+        return level > 0 and self.structure[level - 1] == S
+
+    def _compose(self, start, stop):
+        """Pointers from unique length ``start + 1`` prefixes into length ``stop + 1``"""
+        ptr = self.csf_pointers[start]
+        for level in range(start + 1, stop):
+            ptr = self.csf_pointers[level][ptr]
+        return ptr
+
+    def _grid_ids(self, level):
+        """Positions of csf entries within a "C" level"""
+        index = self.csf_indices[level]
+        if level == 0:
+            return index
+        prev = self.csf_indices[level - 1]
+        parents = np.repeat(np.arange(prev.size), np.diff(self.csf_pointers[level - 1]))
+        if self.structure[level - 1] == C:
+            parents = self._grid_ids(level - 1)[parents]
+        return parents * self.shape[level] + index
+
+    def index(self, level):
+        end = self.ends[level]
+        dtype = self.index_dtypes[level]
+        index = self.csf_indices[level].astype(dtype, copy=False)
+        if self.structure[end] == C:
+            if level == end:
+                if self._after_sparse(end):
+                    repeat = self.csf_indices[end - 1].size
+                else:
+                    repeat = self.sizes[end - 1] if end > 0 else 1
+                return repeatrange(repeat, self.shape[end], dtype=dtype)
+            if level + 1 == end:
+                return np.repeat(index, self.shape[end])
+            return np.repeat(index, np.diff(self._compose(level, end - 1)) * self.shape[end])
+        if level == end:
+            return index
+        return np.repeat(index, np.diff(self._compose(level, end)))
+
+    def pointers(self, level):
+        structure = self.structure
+        size = self.sizes[level]
+        dtype = self.pointer_dtypes[level]
+        if structure[level] == S:
+            return np.arange(size + 1, dtype=dtype)
+        if structure[level + 1] == C:
+            step = self.shape[level + 1]
+            return np.arange(0, (size + 1) * step, step, dtype=dtype)
+        end = self.ends[level + 1]
+        if structure[end] == C:
+            ptr = self._compose(level, end - 1) * self.shape[end]
+        else:
+            ptr = self._compose(level, end)
+        if structure[level] == DC:
+            return ptr.astype(dtype)
+        # "C" level: scatter the counts into the dense grid, which may have empty entries
+        counts = np.zeros(size + 1, dtype)
+        counts[self._grid_ids(level) + 1] = np.diff(ptr)
+        return np.cumsum(counts, out=counts)
+
+
+def cheapest_structure(csf_indices, shape, *, index_dtype=None, pointer_dtype=None):
+    """Return the structure that stores the fewest bytes for the given csf levels.
+
+    The size of every level only depends on the number of unique prefixes of each
+    length, so every structure is priced without building any arrays.  Ties go to
+    the earlier of "DC", "C" and "S".  Structures whose sizes don't fit in the given
+    ``index_dtype`` or ``pointer_dtype`` are skipped.
+    """
+    best = None
+    error = None
+    for sparsity in itertools.product([DC, C, S], repeat=len(shape) - 1):
+        structure = [*sparsity, S]
+        try:
+            builder = LevelBuilder(
+                csf_indices,
+                None,
+                shape,
+                structure,
+                index_dtype=index_dtype,
+                pointer_dtype=pointer_dtype,
+            )
+        except ValueError as exc:
+            error = exc
+            continue
+        if best is None or builder.nbytes < best[0]:
+            best = (builder.nbytes, structure)
+    if best is None:
+        raise error
+    return best[1]
+
+
+class LazyLevels(Sequence):
+    """Level arrays that are each computed by ``func(level)`` when first accessed"""
+
+    def __init__(self, func, size):
+        self._func = func
+        self._levels = [None] * size
+
+    def __len__(self):
+        return len(self._levels)
+
+    def __getitem__(self, level):
+        if isinstance(level, slice):
+            return [self[i] for i in range(len(self))[level]]
+        level = range(len(self))[level]  # Make level positive and check bounds
+        if self._levels[level] is None:
+            self._levels[level] = self._func(level)
+        return self._levels[level]
+
+    @property
+    def computed(self):
+        """Which levels have been computed"""
+        return [array is not None for array in self._levels]
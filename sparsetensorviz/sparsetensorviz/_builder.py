@@ -0,0 +1,140 @@
+"""Collect coordinates incrementally and build a SparseTensor once at the end."""
+
+import numpy as np
+
+from ._build import check_duplicates, min_uint_dtype, reduce_duplicates, sort_coords, sorted_to_csf
+from ._core import SparseTensor
+
+
+class SparseTensorBuilder:
+    """Collect coordinates (and values) in growable buffers to create a SparseTensor.
+
+    Indices are stored in the smallest unsigned integer dtype that fits the shape,
+    and buffers double in capacity when full, so adding a coordinate takes amortized
+    constant time.  Call ``freeze`` to sort the coordinates and create the tensor.
+
+    If ``duplicates`` is not "error", duplicate coordinates are combined whenever
+    the buffers are full, and the buffers only grow if that doesn't free enough
+    space.  ``dtype`` is the dtype of values; values are not stored if it is None,
+    unless ``duplicates="count"``.
+    """
+
+    def __init__(self, shape, *, dtype=None, duplicates="error", capacity=1024):
+        shape = tuple(shape)
+        if not shape:
+            raise ValueError("shape must have at least one dimension")
+        if not all(dimsize > 0 for dimsize in shape):
+            raise ValueError("Dimension sizes must be greater than 0")
+        check_duplicates(duplicates)
+        self.shape = shape
+        self.duplicates = duplicates
+        if duplicates == "count":
+            # Store counts, which are summed
+            dtype = int
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self._index_dtype = min_uint_dtype(max(shape) - 1)
+        self._size = 0
+        self._initial_capacity = max(1, capacity)
+        self._coords = None
+        self._values = None
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def capacity(self):
+        return 0 if self._coords is None else self._coords.shape[1]
+
+    @property
+    def nbytes(self):
+        """Number of bytes of the buffers, including unused capacity"""
+        nbytes = 0 if self._coords is None else self._coords.nbytes
+        if self._values is not None:
+            nbytes += self._values.nbytes
+        return nbytes
+
+    def add(self, coords, values=None):
+        """Add one coordinate of shape ``(ndim,)`` or many of shape ``(k, ndim)``.
+
+        ``values`` may be a scalar or an array with one value per coordinate.
+        """
+        coords = np.asarray(coords)
+        if coords.ndim == 1:
+            coords = coords[None, :]
+        if coords.ndim != 2 or coords.shape[1] != self.ndim:
+            raise ValueError("coords must have shape (ndim,) or (k, ndim)")
+        if not np.issubdtype(coords.dtype, np.integer):
+            raise ValueError("coords must be integer dtype")
+        size = coords.shape[0]
+        if size > 0 and (coords.min() < 0 or (coords.max(axis=0) >= self.shape).any()):
+            raise ValueError("index in coords is out of bounds")
+        if self.duplicates == "count":
+            values = 1
+        elif (values is None) != (self.dtype is None):
+            raise ValueError("values must be given if and only if dtype is given")
+        if size == 0:
+            return
+        if self._size + size > self.capacity:
+            self._reserve(size)
+        stop = self._size + size
+        self._coords[:, self._size : stop] = coords.T
+        if values is not None:
+            self._values[self._size : stop] = values
+        self._size = stop
+
+    def _reserve(self, extra):
+        """Make room for ``extra`` more coordinates"""
+        if self._coords is not None and self.duplicates != "error":
+            self._compact()
+            # Grow unless combining duplicates freed at least half of the buffers
+            if 2 * (self._size + extra) <= self.capacity:
+                return
+        capacity = max(self._size + extra, 2 * self.capacity, self._initial_capacity)
+        coords = np.empty((self.ndim, capacity), self._index_dtype)
+        values = None if self.dtype is None else np.empty(capacity, self.dtype)
+        if self._size:
+            coords[:, : self._size] = self._coords[:, : self._size]
+            if values is not None:
+                values[: self._size] = self._values[: self._size]
+        self._coords = coords
+        self._values = values
+
+    def _compact(self):
+        """Sort the buffers and combine duplicate coordinates"""
+        size = self._size
+        arrays, perm = sort_coords(list(self._coords[:, :size]))
+        _, _, starts = sorted_to_csf(arrays)
+        for i, array in enumerate(arrays):
+            self._coords[i, : starts.size] = array[starts]
+        if self._values is not None:
+            how = "sum" if self.duplicates == "count" else self.duplicates
+            values = self._values[:size][perm]
+            self._values[: starts.size] = reduce_duplicates(values, starts, size, how)
+        self._size = starts.size
+
+    def freeze(self, structure=None, **kwargs):
+        """Create a SparseTensor from the collected coordinates and empty the builder.
+
+        The buffers are given to ``SparseTensor`` without copying them first.  Other
+        keyword arguments such as ``lazy`` or ``index_dtype`` are passed through.
+        """
+        size = self._size
+        if self._coords is None:
+            self._reserve(0)
+        values = None if self._values is None else self._values[:size]
+        rv = SparseTensor(
+            list(self._coords[:, :size]),
+            self.shape,
+            structure,
+            values=values,
+            duplicates="sum" if self.duplicates == "count" else self.duplicates,
+            copy=False,
+            **kwargs,
+        )
+        self._size = 0
+        self._coords = self._values = None
+        return rv
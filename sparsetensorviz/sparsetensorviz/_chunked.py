@@ -0,0 +1,134 @@
+"""Construct csf levels from an iterable of COO chunks that may not fit in memory.
+
+Each chunk is sorted into a run, and runs are spilled to temporary files once the
+runs kept in memory exceed ``max_memory`` bytes.  The runs are then merged k ways
+one block at a time, and each merged block is appended to the csf levels.
+"""
+
+import os
+import tempfile
+
+import numpy as np
+
+from ._build import sort_coords, validate_coords
+
+# Number of coordinates to read from each run at a time while merging
+MERGE_BLOCKSIZE = 1 << 16
+
+
+class CSFAccumulator:
+    """Incrementally compute csf levels from consecutive sorted blocks of coordinates.
+
+    This is the same as ``sorted_to_csf``, but remembers the last coordinate of the
+    previous block so runs of equal prefixes may continue across blocks.
+    """
+
+    def __init__(self, ndim):
+        self.indices = [[] for _ in range(ndim)]
+        self.pointers = [[] for _ in range(ndim - 1)]
+        self.sizes = [0] * ndim
+        self.last = None
+
+    def add(self, arrays):
+        size = arrays[0].size
+        if size == 0:
+            return
+        changed = np.zeros(size, bool)
+        changed[:1] = self.last is None
+        for level, array in enumerate(arrays):
+            nxt = changed.copy()
+            nxt[1:] |= array[1:] != array[:-1]
+            if self.last is not None:
+                nxt[0] |= array[0] != self.last[level]
+            starts = np.flatnonzero(nxt)
+            if level > 0:
+                self.pointers[level - 1].append(np.flatnonzero(changed[starts]) + self.sizes[level])
+            self.indices[level].append(array[starts].astype(int, copy=False))
+            self.sizes[level] += starts.size
+            changed = nxt
+        if starts.size != size:
+            raise ValueError("Duplicate indices found!")
+        self.last = [array[-1] for array in arrays]
+
+    def finish(self):
+        indices = [np.concatenate(index + [np.empty(0, int)]) for index in self.indices]
+        pointers = [
+            np.concatenate(ptr + [np.array([size])])
+            for ptr, size in zip(self.pointers, self.sizes[1:])
+        ]
+        return indices, pointers
+
+
+def _count_le(run, key):
+    """Number of coordinates in a sorted block that are lexicographically <= key"""
+    le = np.zeros(run.shape[1], bool)
+    eq = np.ones(run.shape[1], bool)
+    for array, val in zip(run, key):
+        le |= eq & (array < val)
+        eq &= array == val
+    return np.count_nonzero(le | eq)
+
+
+def merge_runs(runs, blocksize=None):
+    """Yield sorted blocks of coordinates from sorted runs of shape ``(ndim, n)``.
+
+    Every run contributes all of its buffered coordinates that are no greater than
+    the smallest final coordinate of the buffers that don't reach the end of their
+    run, because nothing after that can be smaller.  The run that determines this
+    limit contributes its whole buffer, so each round emits at least one block.
+    """
+    if blocksize is None:
+        blocksize = MERGE_BLOCKSIZE
+    positions = [0] * len(runs)
+    while True:
+        buffers = [run[:, pos : pos + blocksize] for run, pos in zip(runs, positions)]
+        limits = [
+            tuple(buf[:, -1])
+            for run, pos, buf in zip(runs, positions, buffers)
+            if pos + buf.shape[1] < run.shape[1]
+        ]
+        if not limits:
+            # Every buffer reaches the end of its run
+            block = np.concatenate(buffers, axis=1)
+            if block.shape[1] > 0:
+                yield sort_coords(list(block))[0]
+            return
+        limit = min(limits)
+        counts = [_count_le(buf, limit) for buf in buffers]
+        block = np.concatenate([buf[:, :count] for buf, count in zip(buffers, counts)], axis=1)
+        yield sort_coords(list(block))[0]
+        positions = [pos + count for pos, count in zip(positions, counts)]
+
+
+def chunks_to_csf(chunks, shape, *, max_memory=None, blocksize=None):
+    """Compute csf levels from an iterable of COO chunks.
+
+    Each chunk is a list or tuple of index arrays or a coordinate array of shape
+    ``(nnz, ndim)`` like the ``arrays`` argument of ``SparseTensor``.  Sorted runs
+    are kept in memory until they use more than ``max_memory`` bytes, after which
+    they are written to temporary files.
+    """
+    if max_memory is None:
+        max_memory = 1 << 30
+    in_memory = 0
+    runs = []
+    with tempfile.TemporaryDirectory(prefix="sparsetensorviz-") as tmpdir:
+        for chunk in chunks:
+            # Sorting copies, so there is no need to copy first
+            arrays, _ = validate_coords(chunk, shape, copy=False)
+            arrays, _ = sort_coords(arrays)
+            run = np.stack(arrays)
+            if run.shape[1] == 0:
+                continue
+            if in_memory + run.nbytes > max_memory:
+                filename = os.path.join(tmpdir, f"run{len(runs)}.npy")
+                np.save(filename, run)
+                run = np.load(filename, mmap_mode="r")
+            else:
+                in_memory += run.nbytes
+            runs.append(run)
+        acc = CSFAccumulator(len(shape))
+        for block in merge_runs(runs, blocksize):
+            acc.add(block)
+        runs = run = None  # Close memory-mapped files before they are removed
+    return acc.finish()
@@ -1,190 +1,321 @@
+import math
+import operator
+import pickle
+
 import numpy as np
-import pandas as pd
 
+from ._build import (
+    DUPLICATES,
+    LazyLevels,
+    LevelBuilder,
+    cheapest_structure,
+    check_duplicates,
+    combine_duplicates,
+    level_dtypes,
+    levels_to_coo,
+    levels_to_csf,
+    parallel_to_csf,
+    reduce_duplicates,
+    repeatrange,
+    scatter_reduce,
+    sort_coords,
+    sorted_to_csf,
+    transpose_perm,
+    validate_coords,
+    validate_values,
+)
+from ._chunked import chunks_to_csf
+from ._indexing import lookup as _lookup
+from ._indexing import normalize_key, slice_csf, slice_prefix
+from ._memory import PeakTracer
+from ._merge import merge_csf
 from .sparsetype import DC, C, S, abbreviate
 from .sparsetype import from_taco as _from_taco
 from .sparsetype import to_taco as _to_taco
 from .sparsetype import unabbreviate
 
 
-def repeatrange(repeat, *args):
-    """e.g., [0, 1, 2, 0, 1, 2]"""
-    return np.repeat(np.arange(*args)[None, :], repeat, axis=0).ravel()
-
-
 def issorted(array):
     return np.all(array[:-1] <= array[1:])
 
 
+def _normalize_structure(structure, ndim):
+    if isinstance(structure, str) and structure.lower() == "auto":
+        return "auto"  # Chosen once the csf levels are known
+    if structure is None:  # Assume CSF
+        structure = [DC] * (ndim - 1) + [S]
+    elif isinstance(structure, str):
+        structure = unabbreviate(structure)
+    else:
+        structure = unabbreviate(abbreviate(*structure))
+    if len(structure) != ndim:
+        raise ValueError("structure must be the same length as arrays")
+    if structure[-1] != S:
+        # C as the final dimension means "dense"
+        raise ValueError("The final dimension must be sparse structural type")
+    return structure
+
+
+def choose_structure(arrays, shape=None, *, index_dtype=None, pointer_dtype=None):
+    """Return the structure that stores the fewest bytes for COO arrays of indices.
+
+    Indices and pointers are counted only if they need to be stored (i.e., if they
+    are not None in ``SparseTensor.indices`` or ``SparseTensor.pointers``), using
+    the same dtypes as ``SparseTensor``.  This sorts the coordinates once and prices
+    every structure from the number of unique prefixes of each length.
+    """
+    arrays, shape = validate_coords(arrays, shape, copy=False)
+    arrays, _ = sort_coords(arrays)
+    csf_indices, _, _ = sorted_to_csf(arrays)
+    return cheapest_structure(
+        csf_indices, shape, index_dtype=index_dtype, pointer_dtype=pointer_dtype
+    )
+
+
+def _pickle_array(array, protocol):
+    """Wrap an array in a PickleBuffer so protocol 5 can send it out-of-band"""
+    if protocol < 5 or array.dtype.hasobject:
+        return array, None
+    return pickle.PickleBuffer(np.ascontiguousarray(array)), array.dtype
+
+
+def _unpickle_array(data, dtype):
+    return data if dtype is None else np.frombuffer(data, dtype)
+
+
+def _from_pickle(indices, pointers, shape, structure, values, lazy, kwargs):
+    indices = [_unpickle_array(*array) for array in indices]
+    pointers = [_unpickle_array(*array) for array in pointers]
+    if values is not None:
+        values = _unpickle_array(*values)
+    if lazy:
+        # The csf levels were pickled instead
+        return SparseTensor._from_csf(
+            indices, pointers, shape, list(structure), values=values, lazy=True, **kwargs
+        )
+    return SparseTensor._from_levels(
+        indices, pointers, shape, list(structure), values=values, **kwargs
+    )
+
+
 class SparseTensor:
     @classmethod
-    def from_taco(cls, arrays, shape=None, structure=None, *, group_indices=False):
+    def from_taco(cls, arrays, shape=None, structure=None, *, group_indices=False, **kwargs):
         if structure is not None:
             structure = _from_taco(structure)
-        return cls(arrays, shape=shape, structure=structure, group_indices=group_indices)
+        return cls(arrays, shape=shape, structure=structure, group_indices=group_indices, **kwargs)
+
+    def __init__(
+        self,
+        arrays,
+        shape=None,
+        structure=None,
+        *,
+        values=None,
+        duplicates="error",
+        group_indices=False,
+        assume_sorted=False,
+        check_sorted=True,
+        workers=None,
+        copy=True,
+        index_dtype=None,
+        pointer_dtype=None,
+        lazy=False,
+    ):
+        """Create a SparseTensor from COO arrays of indices, one array per dimension.
+
+        ``values`` is an optional array of values for each coordinate.  It is reordered
+        along with the coordinates, so it aligns with the final level and ``arrays``.
+        ``values`` may also be a dict of named arrays (or a structured array) to store
+        several fields that share the same structure.
+
+        ``arrays`` may also be a single array of shape ``(nnz, ndim)``.  Use
+        ``copy=False`` to read integer arrays (or memoryviews) in place instead of
+        first copying them to new int arrays.
 
-    def __init__(self, arrays, shape=None, structure=None, *, group_indices=False):
+        Duplicate coordinates raise unless ``duplicates`` is one of "sum", "min",
+        "max", "first", "last" or "count", which combine their values after sorting.
+        "count" replaces the values with the number of times each coordinate occurs.
+
+        If the indices are already sorted lexicographically, use
+        ``assume_sorted=True`` to skip sorting.  This is verified in linear time unless
+        ``check_sorted=False`` is also given, in which case unsorted input gives
+        undefined results.
+
+        Use ``workers`` to sort and compress ranges of the first dimension in that many
+        processes.  The result is identical to the serial build.
+
+        Index arrays use the smallest unsigned integer dtype that can hold the size of
+        their dimension, and pointers arrays use the smallest that can hold the size of
+        the next level.  Use ``index_dtype`` or ``pointer_dtype`` to choose a dtype for
+        all levels instead.
+
+        Use ``structure="auto"`` to choose the structure that stores the fewest bytes,
+        as computed by ``choose_structure``.
+
+        With ``lazy=True``, only the compressed sorted coordinates are kept, and each
+        level is computed the first time it is used.
+        """
+        check_duplicates(duplicates)
+        tracer = PeakTracer()
         self.group_indices = group_indices
-        if not isinstance(arrays, (list, tuple)):
-            raise TypeError("arrays argument must be a list or tuple of numpy arrays")
-        if not arrays:
-            raise ValueError("At least one array must be given")
-        arrays = [np.array(array) for array in arrays]
-        if not all(array.ndim == 1 for array in arrays):
-            raise ValueError("arrays must be a single dimension")
-        size = arrays[0].size
-        if not all(array.size == size for array in arrays):
-            raise ValueError("arrays must be the same size")
-        if not all(np.issubdtype(array.dtype, np.integer) for array in arrays):
-            raise ValueError("arrays must be integer dtype")
-        if not all((array >= 0).all() for array in arrays):
-            raise ValueError("array values must be positive")
-
-        if shape is not None:
-            self._shape = tuple(shape)
-            if not all(dimsize > 0 for dimsize in self._shape):
-                raise ValueError("Dimension sizes must be greater than 0")
-            if len(self._shape) != len(arrays):
-                raise ValueError("shape must be the same length as arrays")
-            if not all((array < dimsize).all() for array, dimsize in zip(arrays, self._shape)):
-                raise ValueError("index in array is out of bounds")
-        else:
-            self._shape = tuple(int(array.max()) + 1 for array in arrays)
+        self._index_dtype = index_dtype
+        self._pointer_dtype = pointer_dtype
+        self._lazy = lazy
+        arrays, self._shape = validate_coords(arrays, shape, copy=copy)
         shape = self._shape
+        size = arrays[0].size
 
-        if structure is None:  # Assume CSF
-            self._structure = [DC] * (len(arrays) - 1) + [S]
-        elif isinstance(structure, str):
-            self._structure = unabbreviate(structure)
-        else:
-            self._structure = unabbreviate(abbreviate(*structure))
-        if len(self._structure) != len(arrays):
-            raise ValueError("structure must be the same length as arrays")
-        if self._structure[-1] != S:
-            # C as the final dimension means "dense"
-            raise ValueError("The final dimension must be sparse structural type")
+        self._structure = _normalize_structure(structure, len(arrays))
+        if values is not None:
+            values = validate_values(values, size, copy=copy)
 
         # Now the fun part!  Generate the compressed structure from COO
-        df = pd.DataFrame(arrays).T.sort_values(list(range(self.ndim)))
-        if df.duplicated().any():
+        if workers is not None and workers > 1:
+            csf_indices, csf_pointers, starts, perm = parallel_to_csf(
+                arrays,
+                workers,
+                assume_sorted=assume_sorted,
+                check_sorted=assume_sorted and check_sorted,
+                return_perm=values is not None,
+            )
+        else:
+            perm = None
+            if not assume_sorted:
+                arrays, perm = sort_coords(arrays)
+            csf_indices, csf_pointers, starts = sorted_to_csf(
+                arrays, check_sorted=assume_sorted and check_sorted
+            )
+        if starts.size != size and duplicates == "error":
             raise ValueError("Duplicate indices found!")
+        if values is not None and perm is not None:
+            values = values[perm]
+        if starts.size != size or duplicates == "count":
+            values = reduce_duplicates(values, starts, size, duplicates)
+        self._values = values
+        self._build_levels(csf_indices, csf_pointers)
+        self._construction_peak = tracer.stop()
 
-        # First create indices
-        indices = []
-        cols = list(df.columns)
-        num_s_levels = 0
-        prev = None
-        for sparsity, level in zip(self._structure, range(df.shape[-1])):
-            if sparsity == S:
-                num_s_levels += 1
-            elif sparsity == DC:
-                subdf = df[cols[: level + 1]].drop_duplicates()
-                for i in range(-num_s_levels - 1, 0):
-                    indices.append(subdf.iloc[:, i].values)
-                num_s_levels = 0
-            elif sparsity == C:
-                if level == 0:
-                    indices.append(np.arange(shape[level]))
-                elif prev == DC:
-                    subdf = df[cols[:level]].drop_duplicates()
-                    indices.append(repeatrange(len(subdf), shape[level]))
-                elif prev == S:
-                    subdf = df[cols[:level]].drop_duplicates()
-                    subdf = subdf.join(
-                        pd.DataFrame({cols[level]: range(shape[level])}), how="cross"
-                    )
-                    for i in range(-num_s_levels - 1, 0):
-                        indices.append(subdf.iloc[:, i].values)
-                    num_s_levels = 0
-                else:  # prev == C
-                    indices.append(repeatrange(indices[-1].size, shape[level]))
-            prev = sparsity
-        for i in range(-num_s_levels, 0):
-            indices.append(df.iloc[:, i].values)
-        self._indices = indices
-
-        # Now create pointers
-        pointers = []
-        for sparsity, level in zip(self._structure[:-1], range(df.shape[-1] - 1)):
-            if sparsity == S:
-                ptr = np.arange(indices[level].size + 1)
-            elif self._structure[level + 1] == C:
-                ptr = np.arange(len(indices[level]) + 1) * shape[level + 1]
-                if sparsity == C:
-                    # Update subdf to use later
-                    if level == 0:
-                        subdf = pd.DataFrame({cols[level]: range(shape[level])})
-                    elif self._structure[level - 1] == C:
-                        subdf = subdf.join(
-                            pd.DataFrame({cols[level]: range(shape[level])}), how="cross"
-                        )
-                    else:
-                        subdf = df[cols[:level]].drop_duplicates()
-                        subdf = subdf.join(
-                            pd.DataFrame({cols[level]: range(shape[level])}), how="cross"
-                        )
-            elif sparsity == DC:
-                if self._structure[level + 1] == DC:
-                    subdf = df[cols[: level + 2]].drop_duplicates()
-                else:  # sparsity[level + 1] == S
-                    # number of "S" immediately after this level
-                    nums = 0
-                    for item in self._structure[level + 1 :]:
-                        if item == S:
-                            nums += 1
-                        else:
-                            break
-                    subdf = df[cols[: level + nums + 1]].drop_duplicates()
-                    if len(self._structure) > level + nums + 1:
-                        if self._structure[level + nums + 1] == C:
-                            subdf = subdf.join(
-                                pd.DataFrame(
-                                    {cols[level + nums + 1]: range(shape[level + nums + 1])}
-                                ),
-                                how="cross",
-                            )
-                        elif self._structure[level + nums + 1] == DC:
-                            subdf = df[cols[: level + nums + 2]].drop_duplicates()
-                ptr = np.zeros(indices[level].size + 1, int)
-                ptr[1:] = subdf.groupby(cols[: level + 1])[cols[level + 1]].count().cumsum()
-            elif sparsity == C:
-                if level > 0:
-                    if self._structure[level - 1] == C:
-                        subdf1 = subdf
-                    else:
-                        subdf1 = df[cols[:level]].drop_duplicates()
-                subdf = pd.DataFrame({cols[level]: range(shape[level])})
-                if level > 0:
-                    subdf = subdf1.join(subdf, how="cross")
-                if self._structure[level + 1] == DC:
-                    subdf2 = df[cols[: level + 2]].drop_duplicates()
-                else:  # sparsity[level + 1] == S
-                    # number of "S" immediately after this level
-                    nums = 0
-                    for item in self._structure[level + 1 :]:
-                        if item == S:
-                            nums += 1
-                        else:
-                            break
-                    subdf2 = df[cols[: level + nums + 1]].drop_duplicates()
-                    if len(self._structure) > level + nums + 1:
-                        if self._structure[level + nums + 1] == C:
-                            subdf2 = subdf2.join(
-                                pd.DataFrame(
-                                    {cols[level + nums + 1]: range(shape[level + nums + 1])}
-                                ),
-                                how="cross",
-                            )
-                        elif self._structure[level + nums + 1] == DC:
-                            subdf2 = df[cols[: level + nums + 2]].drop_duplicates()
-                subdf3 = subdf.merge(subdf2, how="left")
-                subdf3[level + 1] = subdf3[level + 1].notnull()
-                ptr = np.zeros(indices[level].size + 1, int)
-                ptr[1:] = subdf3.groupby(cols[: level + 1])[level + 1].sum().cumsum()
-            pointers.append(ptr)
-        self._pointers = pointers
-        # TODO: can we detect and change sparsity type to be more efficient?
-        # For example, so we don't need to store a pointers or indices.
+    @classmethod
+    def _from_csf(
+        cls,
+        csf_indices,
+        csf_pointers,
+        shape,
+        structure,
+        *,
+        values=None,
+        group_indices=False,
+        index_dtype=None,
+        pointer_dtype=None,
+        lazy=False,
+    ):
+        self = object.__new__(cls)
+        self._values = values
+        self.group_indices = group_indices
+        self._index_dtype = index_dtype
+        self._pointer_dtype = pointer_dtype
+        self._lazy = lazy
+        self._construction_peak = None
+        self._shape = shape
+        self._structure = structure
+        self._build_levels(csf_indices, csf_pointers)
+        return self
+
+    @classmethod
+    def _from_levels(
+        cls,
+        indices,
+        pointers,
+        shape,
+        structure,
+        *,
+        values=None,
+        group_indices=False,
+        index_dtype=None,
+        pointer_dtype=None,
+    ):
+        self = object.__new__(cls)
+        self._values = values
+        self.group_indices = group_indices
+        self._index_dtype = index_dtype
+        self._pointer_dtype = pointer_dtype
+        self._lazy = False
+        self._construction_peak = None
+        self._shape = shape
+        self._structure = structure
+        self._builder = None
+        self._buffers = {}
+        self._indices = list(indices)
+        self._pointers = list(pointers)
+        return self
+
+    @classmethod
+    def from_chunks(
+        cls,
+        chunks,
+        shape,
+        structure=None,
+        *,
+        group_indices=False,
+        max_memory=None,
+        index_dtype=None,
+        pointer_dtype=None,
+        lazy=False,
+    ):
+        """Create a SparseTensor from an iterable of COO chunks that may not fit in memory.
+
+        Each chunk is a list or tuple of index arrays or a coordinate array of shape
+        ``(nnz, ndim)`` like the ``arrays`` argument of ``SparseTensor``.  Each chunk
+        is sorted, and sorted chunks are written to temporary files once they use more
+        than ``max_memory`` bytes (default 1 GiB).  The sorted chunks are then merged
+        to compute the levels incrementally.
+        """
+        shape = tuple(shape)
+        if not all(dimsize > 0 for dimsize in shape):
+            raise ValueError("Dimension sizes must be greater than 0")
+        structure = _normalize_structure(structure, len(shape))
+        tracer = PeakTracer()
+        csf_indices, csf_pointers = chunks_to_csf(chunks, shape, max_memory=max_memory)
+        rv = cls._from_csf(
+            csf_indices,
+            csf_pointers,
+            shape,
+            structure,
+            group_indices=group_indices,
+            index_dtype=index_dtype,
+            pointer_dtype=pointer_dtype,
+            lazy=lazy,
+        )
+        rv._construction_peak = tracer.stop()
+        return rv
+
+    def _build_levels(self, csf_indices, csf_pointers):
+        if self._structure == "auto":
+            self._structure = cheapest_structure(
+                csf_indices,
+                self._shape,
+                index_dtype=self._index_dtype,
+                pointer_dtype=self._pointer_dtype,
+            )
+        builder = LevelBuilder(
+            csf_indices,
+            csf_pointers,
+            self._shape,
+            self._structure,
+            index_dtype=self._index_dtype,
+            pointer_dtype=self._pointer_dtype,
+        )
+        self._buffers = {}  # Arrays with spare capacity for append
+        if self._lazy:
+            # Keep the csf levels to compute levels from and to transcode cheaply
+            self._builder = builder
+            self._indices = LazyLevels(builder.index, self.ndim)
+            self._pointers = LazyLevels(builder.pointers, self.ndim - 1)
+        else:
+            self._builder = None
+            self._indices = [builder.index(level) for level in range(self.ndim)]
+            self._pointers = [builder.pointers(level) for level in range(self.ndim - 1)]
 
     def _validate(self):
         indices = self._indices
@@ -194,9 +325,9 @@ class SparseTensor:
         shape = self.shape
         assert len(indices) == len(pointers) + 1 == ndim
         for idx in indices:
-            assert idx.dtype == int
+            assert np.issubdtype(idx.dtype, np.integer)
         for ptr in pointers:
-            assert ptr.dtype == int
+            assert np.issubdtype(ptr.dtype, np.integer)
         for idx, ptr in zip(indices[:-1], pointers):
             assert len(ptr) == len(idx) + 1
         for idx, ptr in zip(indices[1:], pointers):
@@ -208,7 +339,7 @@ class SparseTensor:
         assert indices[0][0] >= 0
         assert indices[0][-1] < shape[0]
         for i, (idx, ptr) in enumerate(zip(indices[1:], pointers), 1):
-            for start, stop in zip(ptr[:-1], ptr[1:]):
+            for start, stop in zip(ptr[:-1].tolist(), ptr[1:].tolist()):
                 assert issorted(idx[start:stop])
                 if start < stop:
                     assert idx[start] >= 0
@@ -228,17 +359,447 @@ class SparseTensor:
                 assert len(ptr) == len(set(ptr))
             else:  # pragma: no cover
                 raise AssertionError()
+        if self._values is not None:
+            assert self._values.ndim == 1
+            assert len(self._values) == len(indices[-1])
         assert _from_taco(self.taco_structure) == structure
         # self.taco_view
 
+    def _csf(self):
+        """The csf levels of this tensor"""
+        if self._builder is not None:
+            return self._builder.csf_indices, self._builder.csf_pointers
+        # Coordinates are in the same order for every structure, so transcode the
+        # levels directly instead of sorting or expanding to COO
+        return levels_to_csf(
+            [self.get_index(dim) for dim in range(self.ndim)],
+            [self.get_pointers(dim) for dim in range(self.ndim - 1)],
+        )
+
+    def insert(self, coords, values=None, *, duplicates="error"):
+        """Insert new coordinates (and their values) into this tensor in place.
+
+        ``coords`` and ``values`` are like the ``arrays`` and ``values`` arguments of
+        ``SparseTensor``.  Only the new coordinates are sorted, and they are merged
+        into the existing levels with one linear pass per level.
+
+        ``duplicates`` determines how to combine repeated coordinates, including new
+        coordinates that already exist.  "first" keeps existing values, and "count"
+        adds to existing counts (or to 1 if this tensor has no values).
+        """
+        check_duplicates(duplicates)
+        arrays, _ = validate_coords(coords, self._shape, copy=False)
+        size = arrays[0].size
+        old_values = self._values
+        if duplicates == "count":
+            values = None
+            if old_values is None:
+                old_values = np.ones(len(self._indices[-1]), int)
+        elif (values is None) != (old_values is None):
+            raise ValueError("values must be given if and only if the tensor has values")
+        if values is not None:
+            values = validate_values(values, size, copy=False)
+            if values.dtype.names != old_values.dtype.names:
+                raise ValueError("values must have the same fields as the tensor")
+        arrays, perm = sort_coords(arrays)
+        csf_indices, csf_pointers, starts = sorted_to_csf(arrays)
+        if starts.size != size and duplicates == "error":
+            raise ValueError("Duplicate indices found!")
+        if values is not None:
+            values = values[perm]
+        if starts.size != size or duplicates == "count":
+            values = reduce_duplicates(values, starts, size, duplicates)
+
+        indices, pointers, a_maps, b_maps = merge_csf(
+            *self._csf(), csf_indices, csf_pointers, self._shape
+        )
+        old_map, new_map = a_maps[-1], b_maps[-1]
+        found = np.zeros(indices[-1].size, bool)
+        found[old_map] = True
+        dups = found[new_map]
+        if duplicates == "error" and dups.any():
+            raise ValueError("Duplicate indices found!")
+        if old_values is not None:
+            rv = np.empty(indices[-1].size, old_values.dtype)
+            rv[new_map] = values
+            rv[old_map] = old_values
+            if dups.any():
+                rv[new_map[dups]] = combine_duplicates(rv[new_map[dups]], values[dups], duplicates)
+            old_values = rv
+        self._build_levels(indices, pointers)
+        self._values = old_values
+
+    def append(self, coords, values=None, *, duplicates="error"):
+        """Append coordinates whose leading indices are at least the current maximum.
+
+        Only the new coordinates and existing coordinates with the same leading index
+        as the smallest new one are compressed, and the result is appended to each
+        level in place.  Levels keep spare capacity, so repeated appends take time
+        proportional to the new coordinates.  Arrays previously returned from this
+        tensor may be modified, but sub-tensors from indexing are not.
+
+        ``values`` and ``duplicates`` are like ``insert``, which lazy tensors use.
+        """
+        check_duplicates(duplicates)
+        if self._builder is not None:
+            return self.insert(coords, values, duplicates=duplicates)
+        arrays, _ = validate_coords(coords, self._shape, copy=False)
+        size = arrays[0].size
+        old_values = self._values
+        how = duplicates
+        if duplicates == "count":
+            values = np.ones(size, int)
+            if old_values is None:
+                old_values = np.ones(len(self._indices[-1]), int)
+            how = "sum"
+        elif (values is None) != (old_values is None):
+            raise ValueError("values must be given if and only if the tensor has values")
+        if values is not None:
+            values = validate_values(values, size, copy=False)
+            if values.dtype.names != old_values.dtype.names:
+                raise ValueError("values must have the same fields as the tensor")
+        if size == 0:
+            return
+        first = int(arrays[0].min())
+        # Where entries with leading index >= first begin in each level
+        cuts = [int(np.searchsorted(self._indices[0], first))]
+        end = int(np.searchsorted(self._indices[0], first, side="right"))
+        for ptr in self._pointers:
+            cuts.append(int(ptr[cuts[-1]]))
+            end = int(ptr[end])
+        if end != len(self._indices[-1]):
+            raise ValueError("leading indices must be at least the largest leading index")
+
+        # Rebuild the subtree of the first leading index, shifted to begin at 0
+        tail = levels_to_coo(
+            [index[cut:] for index, cut in zip(self._indices, cuts)],
+            [ptr[cut:] - ptr[cut] for ptr, cut in zip(self._pointers, cuts)],
+        )
+        arrays = [np.concatenate([old, new]) for old, new in zip(tail, arrays)]
+        arrays[0] -= first
+        if values is not None:
+            values = np.concatenate([old_values[cuts[-1] :], values.astype(old_values.dtype)])
+        piece = SparseTensor(
+            arrays,
+            (self._shape[0] - first,) + self._shape[1:],
+            self._structure,
+            values=values,
+            duplicates=how,
+            copy=False,
+            index_dtype=self._index_dtype,
+            pointer_dtype=self._pointer_dtype,
+        )
+        sizes = [cut + len(index) for cut, index in zip(cuts, piece._indices)]
+        pointer_dtypes = level_dtypes(self._pointer_dtype, sizes[1:], "pointer_dtype")
+        for level, index in enumerate(piece._indices):
+            if level == 0:
+                index = index.astype(int) + first
+            self._indices[level] = self._append_array(
+                ("indices", level), self._indices[level], cuts[level], index
+            )
+        for level, (ptr, dtype) in enumerate(zip(piece._pointers, pointer_dtypes)):
+            self._pointers[level] = self._append_array(
+                ("pointers", level),
+                self._pointers[level],
+                cuts[level],
+                ptr.astype(dtype) + cuts[level + 1],
+                dtype,
+            )
+        if values is not None:
+            self._values = self._append_array(("values",), old_values, cuts[-1], piece._values)
+
+    def _append_array(self, key, array, start, extra, dtype=None):
+        """Replace ``array[start:]`` with ``extra`` in a buffer with spare capacity"""
+        if dtype is None:
+            dtype = array.dtype
+        size = start + extra.size
+        buf = self._buffers.get(key)
+        if buf is None or buf.dtype != dtype or buf.size < size:
+            buf = np.empty(size + size // 2, dtype)
+            buf[:start] = array[:start]
+        buf[start:size] = extra
+        self._buffers[key] = buf
+        return buf[:size]
+
+    def lookup(self, coords):
+        """Return the position of each coordinate in the final level, or -1 if missing.
+
+        ``coords`` is an integer array of shape ``(k, ndim)``, or of shape ``(ndim,)``
+        for a single coordinate, in which case a single position is returned.  All
+        coordinates are searched together one level at a time.
+        """
+        coords = np.asarray(coords)
+        single = coords.ndim == 1
+        if single:
+            coords = coords[None, :]
+        if coords.ndim != 2 or coords.shape[1] != self.ndim:
+            raise ValueError("coords must have shape (ndim,) or (k, ndim)")
+        if not np.issubdtype(coords.dtype, np.integer):
+            raise ValueError("coords must be integer dtype")
+        if coords.size and (coords.min() < 0 or (coords.max(axis=0) >= self._shape).any()):
+            raise ValueError("index in coords is out of bounds")
+        rv = _lookup(self, coords.astype(int, copy=False))
+        return int(rv[0]) if single else rv
+
+    def gather(self, coords, fill_value=0):
+        """Return the values of coordinates, using ``fill_value`` for missing ones"""
+        if self._values is None:
+            raise ValueError("tensor has no values")
+        pos = self.lookup(coords)
+        if np.ndim(pos) == 0:
+            return self._values[pos] if pos >= 0 else fill_value
+        rv = np.empty(pos.size, self._values.dtype)
+        found = pos >= 0
+        rv[found] = self._values[pos[found]]
+        rv[~found] = fill_value
+        return rv
+
+    def __getitem__(self, key):
+        """Select a sub-tensor with integers, slices and ellipsis.
+
+        Integers remove their dimension, and slices must have positive steps.  If only
+        the first dimension that isn't an integer is restricted, the levels are sliced
+        directly and share memory with this tensor.  Otherwise, the compressed levels
+        are masked one level at a time.  Coordinates are never expanded to COO.
+        """
+        keys = normalize_key(key, self._shape)
+        dims = [i for i, key in enumerate(keys) if not isinstance(key, int)]
+        if not dims:
+            raise IndexError("at least one dimension must remain; use lookup or gather instead")
+        shape = tuple(len(range(*keys[i])) for i in dims)
+        structure = [self._structure[i] for i in dims]
+        structure[-1] = S
+        kwargs = {
+            "group_indices": self.group_indices,
+            "index_dtype": self._index_dtype,
+            "pointer_dtype": self._pointer_dtype,
+        }
+        if self._builder is None:
+            result = slice_prefix(self, keys)
+            if result is not None:
+                indices, pointers, selected = result
+                values = None if self._values is None else self._values[selected]
+                # The result shares our arrays, so the next append must not write in place
+                self._buffers.clear()
+                return SparseTensor._from_levels(
+                    indices, pointers, shape, structure, values=values, **kwargs
+                )
+        csf_indices, csf_pointers = self._csf()
+        indices, pointers, selected = slice_csf(csf_indices, csf_pointers, keys, self._shape)
+        return SparseTensor._from_csf(
+            indices,
+            pointers,
+            shape,
+            structure,
+            values=None if self._values is None else self._values[selected],
+            lazy=self._lazy,
+            **kwargs,
+        )
+
+    def transpose(self, axes=None, structure=None):
+        """Permute the dimensions of this tensor, reversing them by default.
+
+        The coordinates are radix sorted by the new order of dimensions (see
+        ``transpose_perm``), and the result uses ``structure``, which defaults to the
+        structure of this tensor.
+        """
+        ndim = self.ndim
+        if axes is None:
+            axes = tuple(reversed(range(ndim)))
+        else:
+            axes = tuple(axes)
+            if sorted(axis % ndim for axis in axes if -ndim <= axis < ndim) != list(range(ndim)):
+                raise ValueError("axes don't match tensor")
+            axes = tuple(axis % ndim for axis in axes)
+        if structure is None:
+            structure = self._structure
+        arrays = self.to_coo()
+        values = self._values
+        perm = transpose_perm(arrays, axes, self._shape)
+        if perm is not None:
+            arrays = [arrays[axis][perm] for axis in axes]
+            if values is not None:
+                values = values[perm]
+        else:
+            arrays = [arrays[axis] for axis in axes]
+            if values is not None:
+                values = values.copy()
+        return SparseTensor(
+            arrays,
+            tuple(self._shape[axis] for axis in axes),
+            structure,
+            values=values,
+            group_indices=self.group_indices,
+            assume_sorted=True,
+            check_sorted=False,
+            copy=False,
+            index_dtype=self._index_dtype,
+            pointer_dtype=self._pointer_dtype,
+            lazy=self._lazy,
+        )
+
+    def permute_dims(self, axes, structure=None):
+        """Permute the dimensions of this tensor; the same as ``transpose``"""
+        return self.transpose(axes, structure)
+
+    def _reduce(self, how, axis, structure):
+        ndim = self.ndim
+        if axis is None:
+            axes = set(range(ndim))
+        else:
+            try:
+                axes = {operator.index(axis)}
+            except TypeError:
+                axes = {operator.index(item) for item in axis}
+            if not all(-ndim <= axis < ndim for axis in axes):
+                raise ValueError(f"axis out of bounds for tensor of dimension {ndim}")
+            axes = {axis % ndim for axis in axes}
+        values = self._values
+        if how != "count":
+            if values is None:
+                raise ValueError("tensor has no values")
+            if how == "sum" and values.dtype.names is None:
+                # Use the same dtype as np.sum, which upcasts small integers
+                values = values.astype(np.sum(values[:0]).dtype, copy=False)
+        keep = [dim for dim in range(ndim) if dim not in axes]
+        if not keep:
+            if how == "count":
+                return len(self._indices[-1])
+            if values.dtype.names is None:
+                return DUPLICATES[how].reduce(values)
+            rv = np.empty(1, values.dtype)
+            for name in values.dtype.names:
+                rv[name] = DUPLICATES[how].reduce(values[name])
+            return rv[0]
+        shape = tuple(self._shape[dim] for dim in keep)
+        if structure is None:
+            structure = [self._structure[dim] for dim in keep]
+            structure[-1] = S
+        else:
+            structure = _normalize_structure(structure, len(keep))
+        kwargs = {
+            "group_indices": self.group_indices,
+            "index_dtype": self._index_dtype,
+            "pointer_dtype": self._pointer_dtype,
+            "lazy": self._lazy,
+        }
+        csf_indices, csf_pointers = self._csf()
+        nnz = csf_indices[-1].size
+        if not axes:
+            # Like NumPy, reducing over no axes reduces each value by itself
+            if how == "count":
+                values = np.ones(nnz, int)
+            elif values is self._values:
+                values = values.copy()
+            return SparseTensor._from_csf(
+                csf_indices, csf_pointers, shape, structure, values=values, **kwargs
+            )
+        # Kept dimensions before the first reduced dimension are unique prefixes
+        first = min(axes)
+        if first == 0:
+            leaf_ptr = np.array([0, nnz])
+        else:
+            leaf_ptr = np.arange(nnz + 1)
+            for ptr in reversed(csf_pointers[first - 1 :]):
+                leaf_ptr = leaf_ptr[ptr]
+        if len(keep) == first:
+            # Only trailing dimensions are reduced, so segments of leaves are reduced
+            # in place of each node of the last kept level
+            values = reduce_duplicates(values, leaf_ptr[:-1], nnz, how)
+            return SparseTensor._from_csf(
+                csf_indices[:first],
+                csf_pointers[: first - 1],
+                shape,
+                structure,
+                values=values,
+                **kwargs,
+            )
+        later = keep[first:]
+        later_shape = tuple(self._shape[dim] for dim in later)
+        later_size = math.prod(int(dimsize) for dimsize in later_shape)  # May exceed int64
+        num_prefixes = csf_indices[first - 1].size if first > 0 else 1
+        arrays = self.to_coo()
+        if num_prefixes * later_size > max(4 * nnz, 1 << 20):
+            # Too sparse to regroup in place, so sort instead
+            return SparseTensor(
+                [arrays[dim] for dim in keep],
+                shape,
+                structure,
+                values=values,
+                duplicates=how,
+                copy=False,
+                **kwargs,
+            )
+        # Key each coordinate by its unique prefix and the rest of its kept indices,
+        # which sorts the same way as the result.
+        prefix_ids = np.repeat(np.arange(num_prefixes), np.diff(leaf_ptr))
+        keys = prefix_ids * later_size
+        if later_size > 1:
+            keys += np.ravel_multi_index([arrays[dim] for dim in later], later_shape)
+        keys, values = scatter_reduce(values, keys, num_prefixes * later_size, how)
+        prefix_ids, rest = np.divmod(keys, later_size)
+        prefixes = levels_to_coo(csf_indices[:first], csf_pointers[: first - 1])
+        arrays = [prefix[prefix_ids] for prefix in prefixes]
+        arrays.extend(np.unravel_index(rest, later_shape))
+        return SparseTensor(
+            arrays,
+            shape,
+            structure,
+            values=values,
+            assume_sorted=True,
+            check_sorted=False,
+            copy=False,
+            **kwargs,
+        )
+
+    def sum(self, axis=None, *, structure=None):
+        """Sum values over ``axis`` (an int, tuple of ints, or None for all axes).
+
+        The result is a SparseTensor of the remaining dimensions (with ``structure``)
+        holding the coordinates that have values, or a scalar if all axes are reduced.
+        Reducing trailing axes reduces segments of the final level that are given by
+        pointers.  Otherwise, coordinates are regrouped by their remaining indices
+        without sorting unless that would need much more memory than the tensor.
+        """
+        return self._reduce("sum", axis, structure)
+
+    def count(self, axis=None, *, structure=None):
+        """Count stored coordinates over ``axis``; see ``sum``"""
+        return self._reduce("count", axis, structure)
+
+    def min(self, axis=None, *, structure=None):
+        """Minimum of values over ``axis``; see ``sum``"""
+        return self._reduce("min", axis, structure)
+
+    def max(self, axis=None, *, structure=None):
+        """Maximum of values over ``axis``; see ``sum``"""
+        return self._reduce("max", axis, structure)
+
     def as_structure(self, structure, *, group_indices=None):
         if group_indices is None:
             group_indices = self.group_indices
-        return SparseTensor(self.arrays, self.shape, structure, group_indices=group_indices)
+        tracer = PeakTracer()
+        csf_indices, csf_pointers = self._csf()
+        rv = SparseTensor._from_csf(
+            csf_indices,
+            csf_pointers,
+            self._shape,
+            _normalize_structure(structure, self.ndim),
+            values=None if self._values is None else self._values.copy(),
+            group_indices=group_indices,
+            index_dtype=self._index_dtype,
+            pointer_dtype=self._pointer_dtype,
+            lazy=self._lazy,
+        )
+        rv._construction_peak = tracer.stop()
+        return rv
 
     def get_index(self, dim):
         # Let's demonstrate how to compute indices that don't need to be stored
         dim = range(self.ndim)[dim]  # Make dim positive
+        if self._builder is not None:
+            # Computing sizes from other levels would compute those levels too
+            return self._indices[dim]
         if self._structure[dim] == C:
             size = 1
             for cur in reversed(range(dim)):
@@ -249,15 +810,18 @@ class SparseTensor:
                     if self._structure[cur] == S:
                         size //= self._shape[cur + 1]
                     break
-            return repeatrange(size, self._shape[dim])
+            return repeatrange(size, self._shape[dim], dtype=self._indices[dim].dtype)
         else:
             return self._indices[dim]
 
     def get_pointers(self, dim):
         # Let's demonstrate how to compute pointers that don't need to be stored
         dim = range(self.ndim)[dim]  # Make dim positive
+        if self._builder is not None:
+            return self._pointers[dim]
+        dtype = self._pointers[dim].dtype
         if self._structure[dim] == S:
-            return np.arange(len(self._indices[dim]) + 1)
+            return np.arange(len(self._indices[dim]) + 1, dtype=dtype)
         elif self._structure[dim + 1] == C:
             if self._structure[dim] == DC:
                 size = len(self._indices[dim])
@@ -271,28 +835,124 @@ class SparseTensor:
                         if self._structure[cur] == S:
                             size //= self._shape[cur + 1]
                         break
-            return np.arange(size + 1) * self._shape[dim + 1]
+            step = self._shape[dim + 1]
+            return np.arange(0, (size + 1) * step, step, dtype=dtype)
         else:
             return self._pointers[dim]
 
+    def fibers(self, level):
+        """Return the prefixes and bounds of every fiber below entries of ``level``.
+
+        Returns ``(prefixes, starts, stops)``.  ``prefixes`` is a list of ``level + 1``
+        arrays with the coordinates of each entry of ``level``, and the fiber below
+        each entry is ``get_index(level + 1)[start:stop]``.  Fibers of dense levels
+        may be empty.  ``starts`` and ``stops`` are views of ``get_pointers(level)``.
+        """
+        level = range(self.ndim)[level]  # Make level positive
+        if level == self.ndim - 1:
+            raise IndexError("the last level has no fibers")
+        ptr = self.get_pointers(level)
+        prefixes = levels_to_coo(
+            [self.get_index(i) for i in range(level + 1)],
+            [self.get_pointers(i) for i in range(level)],
+        )
+        return prefixes, ptr[:-1], ptr[1:]
+
+    def iter_fibers(self, level, *, indices=False):
+        """Iterate over the fibers below entries of ``level`` one at a time.
+
+        Yields ``(prefix, start, stop)`` where ``prefix`` is a tuple of coordinates, or
+        ``(prefix, index)`` if ``indices`` is True, where ``index`` is a view of the
+        slice of ``get_index(level + 1)`` in the fiber.
+        """
+        prefixes, starts, stops = self.fibers(level)
+        it = zip(zip(*(prefix.tolist() for prefix in prefixes)), starts.tolist(), stops.tolist())
+        if not indices:
+            yield from it
+            return
+        index = self.get_index(level + 1)
+        for prefix, start, stop in it:
+            yield prefix, index[start:stop]
+
     @property
     def indices(self):
-        rv = list(self._indices)
-        for i, sparsity in enumerate(self._structure):
-            if sparsity == C:
-                rv[i] = None
-        return rv
+        # Don't access levels that aren't stored, since lazy levels would be computed
+        return [self._indices[i] if keep else None for i, keep in enumerate(self._stored_indices())]
 
     @property
     def pointers(self):
-        rv = list(self._pointers)
+        return [
+            self._pointers[i] if keep else None for i, keep in enumerate(self._stored_pointers())
+        ]
+
+    def _stored_indices(self):
+        return [sparsity != C for sparsity in self._structure]
+
+    def _stored_pointers(self):
+        stored = [True] * (self.ndim - 1)
         for i, sparsity in enumerate(self._structure[:-1]):
             if sparsity == S:
-                rv[i] = None
+                stored[i] = False
             elif sparsity == C and i > 0:
-                rv[i - 1] = None
+                stored[i - 1] = False
+        return stored
+
+    def memory_usage(self):
+        """Return the memory used by each array as a dict keyed by array name.
+
+        Keys are ``"indices_0"``, ``"pointers_0"``, ``"indices_1"``, etc., then
+        ``"values"`` if there are values and ``"csf"`` for the compressed coordinates
+        kept by lazy tensors.  Each value is a dict of:
+
+        - "stored": whether the structure needs to store the array
+        - "materialized": whether the array is currently in memory
+        - "nbytes": the size of the array, even if it isn't materialized
+        """
+        builder = self._builder
+        stored_pointers = self._stored_pointers()
+        rv = {}
+        for i, stored in enumerate(self._stored_indices()):
+            if builder is None or self._indices.computed[i]:
+                materialized, nbytes = True, self._indices[i].nbytes
+            else:
+                materialized = False
+                nbytes = builder.sizes[i] * builder.index_dtypes[i].itemsize
+            rv[f"indices_{i}"] = {"stored": stored, "materialized": materialized, "nbytes": nbytes}
+            if i == len(stored_pointers):
+                continue
+            if builder is None or self._pointers.computed[i]:
+                materialized, nbytes = True, self._pointers[i].nbytes
+            else:
+                materialized = False
+                nbytes = (builder.sizes[i] + 1) * builder.pointer_dtypes[i].itemsize
+            rv[f"pointers_{i}"] = {
+                "stored": stored_pointers[i],
+                "materialized": materialized,
+                "nbytes": nbytes,
+            }
+        if self._values is not None:
+            rv["values"] = {"stored": True, "materialized": True, "nbytes": self._values.nbytes}
+        if builder is not None:
+            nbytes = sum(array.nbytes for array in builder.csf_indices + builder.csf_pointers)
+            rv["csf"] = {"stored": False, "materialized": True, "nbytes": nbytes}
         return rv
 
+    @property
+    def nbytes(self):
+        """Number of bytes of all arrays currently in memory, including values"""
+        return sum(
+            usage["nbytes"] for usage in self.memory_usage().values() if usage["materialized"]
+        )
+
+    @property
+    def construction_peak(self):
+        """Peak bytes allocated while constructing this tensor, or None.
+
+        This is only measured for tensors created inside ``trace_construction()``,
+        so the peak of ``tracemalloc`` isn't reset otherwise.
+        """
+        return self._construction_peak
+
     @property
     def ndim(self):
         return len(self._shape)
@@ -311,7 +971,41 @@ class SparseTensor:
 
     @property
     def arrays(self):
-        return [np.array(array) for array in zip(*_to_coo(self._indices, self._pointers))]
+        return self.to_coo()
+
+    def to_coo(self, out=None):
+        """Return COO arrays of indices, one array per dimension, in sorted order.
+
+        ``out`` may be a sequence of integer arrays, one per dimension, or an array of
+        shape ``(nnz, ndim)`` to fill in place instead of allocating new arrays.
+        """
+        if out is not None:
+            nnz = len(self._indices[-1])
+            arrays = out.T if isinstance(out, np.ndarray) and out.ndim == 2 else out
+            if len(arrays) != self.ndim:
+                raise ValueError("out must have an array for each dimension")
+            for array, dimsize in zip(arrays, self._shape):
+                if not isinstance(array, np.ndarray) or array.shape != (nnz,):
+                    raise ValueError("out arrays must be one dimension the same size as nnz")
+                if not np.issubdtype(array.dtype, np.integer):
+                    raise ValueError("out arrays must be integer dtype")
+                if np.iinfo(array.dtype).max < dimsize - 1:
+                    raise ValueError(f"out array of dtype {array.dtype} can't hold size {dimsize}")
+            levels_to_coo(self._indices, self._pointers, list(arrays))
+            return out
+        return levels_to_coo(self._indices, self._pointers)
+
+    @property
+    def values(self):
+        """Values of each coordinate in the same order as ``arrays``, or None"""
+        return self._values
+
+    @property
+    def fields(self):
+        """Names of the value fields, or None if values are not a structured array"""
+        if self._values is None:
+            return None
+        return self._values.dtype.names
 
     @property
     def taco_structure(self):
@@ -327,6 +1021,30 @@ class SparseTensor:
 
         return to_bundled_groups(self)
 
+    def __reduce_ex__(self, protocol):
+        # With protocol 5, level arrays are PickleBuffers that may be sent out-of-band.
+        # Lazy tensors pickle their csf levels, and levels are computed again on load.
+        if self._builder is not None:
+            indices = self._builder.csf_indices
+            pointers = self._builder.csf_pointers
+        else:
+            indices = self._indices
+            pointers = self._pointers
+        kwargs = {
+            "group_indices": self.group_indices,
+            "index_dtype": self._index_dtype,
+            "pointer_dtype": self._pointer_dtype,
+        }
+        return _from_pickle, (
+            [_pickle_array(array, protocol) for array in indices],
+            [_pickle_array(array, protocol) for array in pointers],
+            self._shape,
+            tuple(self._structure),
+            None if self._values is None else _pickle_array(self._values, protocol),
+            self._builder is not None,
+            kwargs,
+        )
+
     def _repr_svg_(self, *, as_taco=False, as_groups=None):
         try:
             from ._formatting import to_svg
@@ -351,10 +1069,11 @@ class TacoView:
         self._fake.group_indices = self._parent.group_indices
         self._fake._structure = [DC] + parent._structure
         self._fake._shape = (1,) + parent._shape
-        self._fake._indices = [np.array([0])] + self._parent._indices
-        self._fake._pointers = [
-            np.array([0, self._parent._indices[0].size])
-        ] + self._parent._pointers
+        self._fake._builder = None
+        self._fake._indices = [np.array([0])] + list(self._parent._indices)
+        self._fake._pointers = [np.array([0, self._parent._indices[0].size])] + list(
+            self._parent._pointers
+        )
         # assert self._parent.taco_structure == self._fake.taco_structure[1:]
 
     def get_index(self, dim):
@@ -364,6 +1083,12 @@ class TacoView:
         dim = range(self.ndim)[dim]  # Make dim positive
         return self._fake.get_pointers(dim)
 
+    def fibers(self, level):
+        return self._parent.fibers(level)
+
+    def iter_fibers(self, level, *, indices=False):
+        return self._parent.iter_fibers(level, indices=indices)
+
     @property
     def group_indices(self):
         return self._parent.group_indices
@@ -402,22 +1127,33 @@ class TacoView:
     def arrays(self):
         return self._parent.arrays
 
+    def to_coo(self, out=None):
+        return self._parent.to_coo(out)
+
+    @property
+    def values(self):
+        return self._parent.values
+
+    def memory_usage(self):
+        return self._parent.memory_usage()
+
+    @property
+    def nbytes(self):
+        return self._parent.nbytes
+
+    @property
+    def construction_peak(self):
+        return self._parent.construction_peak
+
+    @property
+    def fields(self):
+        return self._parent.fields
+
+    def __reduce_ex__(self, protocol):
+        return TacoView, (self._parent,)
+
     def _repr_svg_(self):
         return self._fake._repr_svg_(as_taco=True)
 
     def __repr__(self):
         return self._fake.__repr__(as_taco=True)
-
-
-def _to_coo(indices, pointers, start=0, stop=None):
-    index, *indices = indices
-    if stop is None:
-        stop = len(index)
-    if not indices:
-        for idx in index[start:stop]:
-            yield (idx,)
-        return
-    ptrs, *pointers = pointers
-    for idx, start, stop in zip(index[start:stop], ptrs[start:stop], ptrs[start + 1 : stop + 1]):
-        for indexes in _to_coo(indices, pointers, start, stop):
-            yield (idx,) + indexes
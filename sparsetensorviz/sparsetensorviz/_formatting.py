@@ -12,93 +12,63 @@ TACO_ABBV = {
 }
 
 
-def _to_level(indices, pointers, level=0, start=0, stop=None):
-    index, *indices = indices
-    if stop is None:
-        stop = len(index)
-    if not indices:
-        for _ in range(start, stop):
-            yield level
-            level += 1
-        return
-    ptrs, *pointers = pointers
-    for start, stop in zip(ptrs[start:stop], ptrs[start + 1 : stop + 1]):
-        levels = list(_to_level(indices, pointers, level, start, stop))
-        yield [level, levels]
-        maxlevel = level
-        while levels:
-            vals = [val for val in levels if not isinstance(val, list)]
-            if vals:
-                maxlevel = max(maxlevel, max(vals))
-            levels = list(concat(val for val in levels if isinstance(val, list)))
-        level = maxlevel + 1
+def _int_levels(self):
+    # Narrow unsigned dtypes may overflow with the arithmetic below
+    indices = [index.astype(int) for index in self._indices]
+    pointers = [ptr.astype(int) for ptr in self._pointers]
+    return indices, pointers
 
 
-def index_levels(self):
-    levels = list(_to_level(self._indices, self._pointers))
-    if self.ndim == 1:
-        return [levels]
-    rv = []
-    rv.append([x for x, _ in levels])
-    for _ in range(len(self._pointers) - 1):
-        levels = list(concat(y for _, y in levels))
-        rv.append([x for x, _ in levels])
-    rv.append(list(concat(y for _, y in levels)))
-    return rv
+def _segment_sums(array, starts, stops):
+    cumsum = np.pad(array.cumsum(), (1, 0))
+    return cumsum[stops] - cumsum[starts]
 
 
-def _to_group(indices, pointers, group=None, start=0, stop=None, *, compact=None):
-    if compact is None:
-        compact = True
-    index, *indices = indices
-    if stop is None:
-        stop = len(index)
-    if not indices:
-        for i in range(start, stop):
-            if group is None:
-                yield i
-            else:
-                yield group
-        return
-    if index.size == 0:  # Can this happen?
-        return
-    ptrs, *pointers = pointers
-    i = 0
-    prev_idx = index[0]
-    for idx, start, stop in zip(index, ptrs[start:stop], ptrs[start + 1 : stop + 1]):
-        if group is not None:
-            cur_group = group
-        elif not compact:
-            cur_group = i
-            i += 1
-        elif idx != prev_idx:
-            i += 1
-            cur_group = i
-            prev_idx = idx
-        else:
-            cur_group = i
-        groups = list(_to_group(indices, pointers, cur_group, start, stop))
-        yield [cur_group, groups]
+def index_levels(self):
+    """Return the row of each entry of each level when drawn as a tree.
+
+    The first child of an entry is on the same row as its parent, and each subtree
+    takes as many rows as it has leaves (or one row if it has none).  Subtree
+    heights are summed over fibers from the last level to the first, then rows are
+    offset within fibers from the first level to the last.
+    """
+    indices, pointers = _int_levels(self)
+    heights = [np.ones(len(indices[-1]), int)]
+    for ptr in reversed(pointers):
+        heights.append(np.maximum(_segment_sums(heights[-1], ptr[:-1], ptr[1:]), 1))
+    heights.reverse()
+    rows = np.pad(heights[0].cumsum(), (1, 0))[:-1]
+    rv = [rows.tolist()]
+    for ptr, height in zip(pointers, heights[1:]):
+        offsets = np.pad(height.cumsum(), (1, 0))
+        rows = np.repeat(rows - offsets[ptr[:-1]], np.diff(ptr)) + offsets[:-1]
+        rv.append(rows.tolist())
+    return rv
 
 
 def index_groups(self, *, compact=None):
+    """Return the group of each entry of each level, which is its top-level ancestor.
+
+    If ``compact`` is True (the default), top-level entries with the same index are
+    in the same group.
+    """
     if compact is None:
         compact = True
-    groups = list(_to_group(self._indices, self._pointers, compact=compact))
-    if self.ndim == 1:
-        return [groups]
-    rv = []
-    rv.append([x for x, _ in groups])
-    for _ in range(len(self._pointers) - 1):
-        groups = list(concat(y for _, y in groups))
-        rv.append([x for x, _ in groups])
-    rv.append(list(concat(y for _, y in groups)))
+    indices, pointers = _int_levels(self)
+    index = indices[0]
+    if compact and self.ndim > 1:
+        groups = np.pad(np.cumsum(index[1:] != index[:-1]), (1, 0))[: index.size]
+    else:
+        groups = np.arange(index.size)
+    rv = [groups.tolist()]
+    for ptr in pointers:
+        groups = np.repeat(groups, np.diff(ptr))
+        rv.append(groups.tolist())
     return rv
 
 
 def get_layout(self, *, squared=False, compact=None):
-    indices = self._indices
-    pointers = self._pointers
+    indices, pointers = _int_levels(self)
 
     # Xs is easy
     index_widths = [2 + max(2, len(str(index.max()))) for index in indices]
@@ -275,8 +245,7 @@ def draw_pointer(canvas, x, y, w, ptr, *, center_right=False, skip_if_nonempty=F
 
 
 def to_text(self, *, squared=False, compact=None, as_taco=False, as_groups=False):
-    indices = self._indices
-    pointers = self._pointers
+    indices, pointers = _int_levels(self)
     index_widths, pointers_widths, xoffsets, yoffsets = get_layout(
         self, squared=squared, compact=compact
     )
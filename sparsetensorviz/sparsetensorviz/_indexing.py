@@ -0,0 +1,219 @@
+"""Find coordinates in the levels of a SparseTensor without expanding to COO."""
+
+import operator
+
+import numpy as np
+
+from .sparsetype import C, S
+
+
+def bisect(index, lo, hi, values, side="left"):
+    """Vectorized bisection of sorted ``index[lo:hi]`` for each value.
+
+    ``lo``, ``hi`` and ``values`` are arrays with an item per search, and each loop
+    halves every range, so there are only as many loops as bits in the longest range.
+    """
+    lo = lo.copy()
+    hi = hi.copy()
+    # Only keep working on searches whose ranges are not empty yet
+    todo = np.flatnonzero(lo < hi)
+    while todo.size:
+        cur_lo = lo[todo]
+        cur_hi = hi[todo]
+        mid = (cur_lo + cur_hi) // 2
+        midval = index[mid]
+        vals = values[todo]
+        right = (midval < vals) if side == "left" else (midval <= vals)
+        cur_lo = np.where(right, mid + 1, cur_lo)
+        cur_hi = np.where(right, cur_hi, mid)
+        lo[todo] = cur_lo
+        hi[todo] = cur_hi
+        todo = todo[cur_lo < cur_hi]
+    return lo
+
+
+def lookup(tensor, coords):
+    """Position of each coordinate of shape ``(k, ndim)`` in the final level, or -1.
+
+    Each level narrows the range of entries that may hold each coordinate.  "C"
+    levels are dense, so the position is the start of the range plus the index.
+    "DC" and "S" levels are searched by bisection; "S" levels may repeat an index,
+    so they find the range of entries equal to the index.
+    """
+    structure = tensor.structure
+    shape = tensor.shape
+    size = coords.shape[0]
+    found = np.ones(size, bool)
+    lo = np.zeros(size, int)
+    hi = np.full(size, len(tensor.get_index(0)) if structure[0] != C else shape[0])
+    for level, sparsity in enumerate(structure):
+        values = coords[:, level]
+        if sparsity == C:
+            pos = lo + values
+            stop = pos + 1
+            found &= lo < hi
+        else:
+            index = tensor.get_index(level)
+            pos = bisect(index, lo, hi, values)
+            if sparsity == S and level + 1 < len(structure):
+                stop = bisect(index, pos, hi, values, side="right")
+            else:
+                stop = pos + 1
+            found &= pos < hi
+            found[found] = index[pos[found]] == values[found]
+        if level + 1 == len(structure):
+            break
+        pos[~found] = stop[~found] = 0
+        if sparsity == S:
+            lo, hi = pos, stop
+        else:
+            ptr = tensor.get_pointers(level)
+            lo = ptr[pos].astype(int)
+            hi = ptr[stop].astype(int)
+            hi[~found] = 0
+    return np.where(found, pos, -1)
+
+
+def normalize_key(key, shape):
+    """Return an int or a ``(start, stop, step)`` tuple for each dimension"""
+    if not isinstance(key, tuple):
+        key = (key,)
+    if sum(item is Ellipsis for item in key) > 1:
+        raise IndexError("an index can only have a single ellipsis ('...')")
+    if Ellipsis in key:
+        i = key.index(Ellipsis)
+        key = key[:i] + (slice(None),) * (len(shape) - len(key) + 1) + key[i + 1 :]
+    if len(key) > len(shape):
+        raise IndexError(
+            f"too many indices: tensor is {len(shape)}-dimensional, but {len(key)} were indexed"
+        )
+    key = key + (slice(None),) * (len(shape) - len(key))
+    rv = []
+    for item, dimsize in zip(key, shape):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(dimsize)
+            if step < 0:
+                raise IndexError("slices with negative steps are not supported")
+            if len(range(start, stop, step)) == 0:
+                raise IndexError("slices must not be empty")
+            rv.append((start, stop, step))
+        else:
+            try:
+                if isinstance(item, (bool, np.bool_)):
+                    raise TypeError  # NumPy treats booleans as masks
+                index = operator.index(item)
+            except TypeError:
+                raise IndexError(
+                    "only integers, slices (`:`) and ellipsis (`...`) are valid indices"
+                ) from None
+            if not -dimsize <= index < dimsize:
+                raise IndexError(f"index {index} is out of bounds for size {dimsize}")
+            rv.append(index % dimsize)
+    return rv
+
+
+def _is_full(key, dimsize):
+    return key == (0, dimsize, 1)
+
+
+def slice_prefix(tensor, keys):
+    """Slice the levels directly if only the first non-integer key may restrict.
+
+    Each level then holds the selected coordinates in one contiguous range, so the
+    result uses views of the level arrays, except that pointers are rebased and the
+    first level is shifted by the start of its slice.  Returns None otherwise.
+    """
+    shape = tensor.shape
+    first = 0
+    while first < len(keys) and isinstance(keys[first], int):
+        first += 1
+    if first == len(keys) or any(
+        not _is_full(key, dimsize) for key, dimsize in zip(keys[first + 1 :], shape[first + 1 :])
+    ):
+        return None
+    if keys[first][2] != 1:
+        return None
+    indices = tensor._indices
+    pointers = tensor._pointers
+    # Find the range of each level that holds the selected coordinates
+    starts = []
+    stops = []
+    start, stop = 0, len(indices[0])
+    for level, key in enumerate(keys):
+        if level <= first:
+            index = indices[level][start:stop]
+            if isinstance(key, int):
+                lo, hi = key, key + 1
+            else:
+                lo, hi = key[:2]
+            start, stop = start + np.searchsorted(index, [lo, hi]).astype(int)
+        starts.append(start)
+        stops.append(stop)
+        if level + 1 < len(keys):
+            start, stop = int(pointers[level][start]), int(pointers[level][stop])
+    if starts[first] == stops[first] and C in tensor.structure[first:]:
+        # Kept dense levels still need entries, so build them from the csf levels
+        return None
+    new_indices = [index[start:stop] for index, start, stop in zip(indices, starts, stops)]
+    new_pointers = [
+        ptr[start : stop + 1] - ptr[start] if start else ptr[: stop + 1]
+        for ptr, start, stop in zip(pointers, starts, stops)
+    ]
+    offset = keys[first][0]
+    if offset:
+        index = new_indices[first]
+        new_indices[first] = (index.astype(int) - offset).astype(index.dtype)
+    return new_indices[first:], new_pointers[first:], slice(starts[-1], stops[-1])
+
+
+def _key_mask(index, key):
+    if isinstance(key, int):
+        return index == key
+    start, stop, step = key
+    mask = (index >= start) & (index < stop)
+    if step != 1:
+        mask &= (index - start) % step == 0
+    return mask
+
+
+def slice_csf(csf_indices, csf_pointers, keys, shape):
+    """Select coordinates from csf levels by an int or range for each dimension.
+
+    Nodes are masked from the first level to the last, then nodes with no remaining
+    coordinates below them are removed from the last level to the first.  Levels of
+    integer keys are dropped.  Also returns the mask of the selected coordinates.
+    """
+    ndim = len(keys)
+    alive = []
+    for level, (key, dimsize) in enumerate(zip(keys, shape)):
+        index = csf_indices[level]
+        mask = None if _is_full(key, dimsize) else _key_mask(index, key)
+        if level > 0:
+            parents = np.repeat(alive[-1], np.diff(csf_pointers[level - 1]))
+            mask = parents if mask is None else mask & parents
+        elif mask is None:
+            mask = np.ones(index.size, bool)
+        alive.append(mask)
+    for level in reversed(range(ndim - 1)):
+        cumsum = np.concatenate([[0], np.cumsum(alive[level + 1])])
+        ptr = csf_pointers[level]
+        alive[level] &= cumsum[ptr[1:]] > cumsum[ptr[:-1]]
+    indices = []
+    pointers = []
+    refs = None  # Position in the result of the closest kept ancestor (or self) of each node
+    for level, key in enumerate(keys):
+        keep = alive[level]
+        if level == 0:
+            parents = np.zeros(keep.size, int)
+        else:
+            parents = np.repeat(refs, np.diff(csf_pointers[level - 1]))
+        if isinstance(key, int):
+            refs = parents
+            continue
+        if indices:
+            counts = np.bincount(parents[keep], minlength=indices[-1].size)
+            pointers.append(np.concatenate([[0], np.cumsum(counts)]))
+        start, _, step = key
+        indices.append((csf_indices[level][keep] - start) // step)
+        refs = np.cumsum(keep) - 1
+    return indices, pointers, alive[-1]
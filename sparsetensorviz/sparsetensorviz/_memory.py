@@ -0,0 +1,61 @@
+"""Measure memory allocated while constructing a SparseTensor."""
+
+import tracemalloc
+import weakref
+from contextlib import contextmanager
+
+_depth = 0  # Number of active ``trace_construction`` blocks
+_active = weakref.WeakSet()  # Tracers that haven't stopped
+
+
+@contextmanager
+def trace_construction():
+    """Measure ``construction_peak`` of SparseTensors created in this block.
+
+    This starts ``tracemalloc`` if it isn't already tracing (and stops it at the end).
+    Each construction resets the peak of ``tracemalloc``, so peaks measured by other
+    code that overlap this block will be too low.  Outside of this block, the peak
+    is never reset.  Peaks are not measured before Python 3.9, which added
+    ``tracemalloc.reset_peak``, so ``construction_peak`` is None there.
+    """
+    global _depth
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    _depth += 1
+    try:
+        yield
+    finally:
+        _depth -= 1
+        if started:
+            tracemalloc.stop()
+
+
+class PeakTracer:
+    """Measure the peak memory allocated after creation inside ``trace_construction``.
+
+    NumPy reports its allocations to tracemalloc, so this includes temporary arrays.
+    The peak of tracemalloc is reset when this is created, after recording it in any
+    enclosing tracers, so nested constructions don't lower their peaks.
+    """
+
+    def __init__(self):
+        self.tracing = (
+            _depth > 0 and tracemalloc.is_tracing() and hasattr(tracemalloc, "reset_peak")
+        )
+        if self.tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            for tracer in _active:
+                tracer.peak = max(tracer.peak, peak)
+            self.start = self.peak = current
+            tracemalloc.reset_peak()
+            _active.add(self)
+
+    def stop(self):
+        """Return the peak number of bytes allocated since creation, or None"""
+        if not self.tracing:
+            return None
+        _active.discard(self)
+        if not tracemalloc.is_tracing():
+            return None
+        return max(self.peak, tracemalloc.get_traced_memory()[1]) - self.start
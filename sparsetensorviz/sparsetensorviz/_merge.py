@@ -0,0 +1,79 @@
+"""Merge the csf levels of two tensors of the same shape one level at a time.
+
+A node of level ``i`` is keyed by ``parent * shape[i] + index``, where ``parent`` is
+the position of its parent in the merged level ``i - 1``.  Keys of each level are
+sorted and unique, so merging a level only needs ``searchsorted`` and ``np.insert``,
+and keys of the merged level give its pointers directly.
+"""
+
+import numpy as np
+
+
+def merge_keys(a_keys, b_keys):
+    """Merge sorted unique keys and return the keys and positions of the input keys.
+
+    This is efficient when ``b_keys`` is small, since only ``b_keys`` is searched.
+    """
+    pos = np.searchsorted(a_keys, b_keys)
+    found = pos < a_keys.size
+    found[found] = a_keys[pos[found]] == b_keys[found]
+    new_pos = pos[~found]
+    keys = np.insert(a_keys, new_pos, b_keys[~found])
+    # Keys of a shift by the number of new keys inserted before them
+    a_map = np.arange(a_keys.size) + np.cumsum(np.bincount(new_pos, minlength=a_keys.size + 1))[:-1]
+    b_map = np.empty(b_keys.size, int)
+    b_map[found] = a_map[pos[found]]
+    b_map[~found] = new_pos + np.arange(new_pos.size)
+    return keys, a_map, b_map
+
+
+def merge_csf(a_indices, a_pointers, b_indices, b_pointers, shape):
+    """Return the csf levels of the union of two tensors.
+
+    Also returns, for each level, the positions of the nodes of ``a`` and of ``b``
+    within the merged level.
+    """
+    indices = []
+    pointers = []
+    a_maps = []
+    b_maps = []
+    for level, dimsize in enumerate(shape):
+        a_keys = a_indices[level].astype(int)
+        b_keys = b_indices[level].astype(int)
+        if level > 0:
+            if indices[-1].size * dimsize > np.iinfo(np.int64).max:
+                raise OverflowError("tensor is too large to merge")
+            a_keys += np.repeat(a_maps[-1], np.diff(a_pointers[level - 1])) * dimsize
+            b_keys += np.repeat(b_maps[-1], np.diff(b_pointers[level - 1])) * dimsize
+        keys, a_map, b_map = merge_keys(a_keys, b_keys)
+        if level > 0:
+            parents, keys = np.divmod(keys, dimsize)
+            changed = np.ones(keys.size, bool)
+            changed[1:] = parents[1:] != parents[:-1]
+            pointers.append(np.append(np.flatnonzero(changed), keys.size))
+        indices.append(keys)
+        a_maps.append(a_map)
+        b_maps.append(b_map)
+    return indices, pointers, a_maps, b_maps
+
+
+def mask_csf(indices, pointers, mask):
+    """Keep the coordinates of csf levels where ``mask`` is True.
+
+    Nodes with no remaining coordinates below them are removed from the last level to
+    the first.
+    """
+    ndim = len(indices)
+    alive = [None] * ndim
+    alive[-1] = mask
+    counts = [None] * (ndim - 1)
+    for level in reversed(range(ndim - 1)):
+        counts[level] = np.concatenate([[0], np.cumsum(alive[level + 1])])
+        ptr = pointers[level]
+        alive[level] = counts[level][ptr[1:]] > counts[level][ptr[:-1]]
+    new_indices = [index[keep] for index, keep in zip(indices, alive)]
+    new_pointers = [
+        np.append(cumsum[ptr[:-1][keep]], cumsum[-1])
+        for ptr, keep, cumsum in zip(pointers, alive, counts)
+    ]
+    return new_indices, new_pointers
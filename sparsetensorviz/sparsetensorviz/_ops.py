@@ -0,0 +1,90 @@
+"""Element-wise set operations on the sparsity patterns of two SparseTensors."""
+
+import numpy as np
+
+from ._core import SparseTensor, _normalize_structure
+from ._merge import mask_csf, merge_csf
+
+
+def _combine(combine, x, y):
+    if x.dtype.names is not None:
+        rv = np.empty(x.size, x.dtype)
+        for name in x.dtype.names:
+            rv[name] = combine(x[name], y[name])
+        return rv
+    return combine(x, y)
+
+
+def _merge(a, b):
+    """Merge the csf levels of ``a`` and ``b`` and align their values to the result.
+
+    Returns the merged levels, whether each coordinate is in ``a`` and in ``b``, and
+    the values of ``a`` and of ``b`` at each coordinate (or None).
+    """
+    if a.shape != b.shape:
+        raise ValueError(f"shapes must be the same; got {a.shape} and {b.shape}")
+    a_indices, a_pointers = a._csf()
+    b_indices, b_pointers = b._csf()
+    indices, pointers, a_maps, b_maps = merge_csf(
+        a_indices, a_pointers, b_indices, b_pointers, a.shape
+    )
+    size = indices[-1].size
+    in_a = np.zeros(size, bool)
+    in_a[a_maps[-1]] = True
+    in_b = np.zeros(size, bool)
+    in_b[b_maps[-1]] = True
+    a_values = b_values = None
+    if a.values is not None and b.values is not None:
+        a_values = np.zeros(size, a.values.dtype)
+        a_values[a_maps[-1]] = a.values
+        b_values = np.zeros(size, b.values.dtype)
+        b_values[b_maps[-1]] = b.values
+    return indices, pointers, in_a, in_b, a_values, b_values
+
+
+def _result(a, indices, pointers, structure, values):
+    return SparseTensor._from_csf(
+        indices,
+        pointers,
+        a.shape,
+        a.structure if structure is None else _normalize_structure(structure, a.ndim),
+        values=values,
+        group_indices=a.group_indices,
+        index_dtype=a._index_dtype,
+        pointer_dtype=a._pointer_dtype,
+        lazy=a._lazy,
+    )
+
+
+def intersect(a, b, combine=np.multiply, *, structure=None):
+    """Return the coordinates in both ``a`` and ``b`` as a new SparseTensor.
+
+    The csf levels of both tensors are merged one level at a time, and coordinates
+    that aren't in both are then pruned from the last level to the first.  If both
+    tensors have values, they are combined with ``combine`` (applied to each field
+    of structured values).  The result uses the structure of ``a`` by default.
+    """
+    indices, pointers, in_a, in_b, a_values, b_values = _merge(a, b)
+    both = in_a & in_b
+    indices, pointers = mask_csf(indices, pointers, both)
+    values = None
+    if a_values is not None:
+        values = _combine(combine, a_values[both], b_values[both])
+    return _result(a, indices, pointers, structure, values)
+
+
+def union(a, b, combine=np.add, *, structure=None):
+    """Return the coordinates in either ``a`` or ``b`` as a new SparseTensor.
+
+    The csf levels of both tensors are merged one level at a time.  If both tensors
+    have values, values of coordinates in both are combined with ``combine``
+    (applied to each field of structured values), and the others are kept as is.
+    The result uses the structure of ``a`` by default.
+    """
+    indices, pointers, in_a, in_b, a_values, b_values = _merge(a, b)
+    values = None
+    if a_values is not None:
+        both = in_a & in_b
+        values = np.where(in_a, a_values, b_values)
+        values[both] = _combine(combine, a_values[both], b_values[both])
+    return _result(a, indices, pointers, structure, values)
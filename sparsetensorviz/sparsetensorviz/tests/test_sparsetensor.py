@@ -1,11 +1,24 @@
 import itertools
+import pickle
 import random
+import tracemalloc
 
 import numpy as np
 import pandas as pd
 import pytest
 
-from sparsetensorviz import SparseTensor
+from sparsetensorviz import (
+    DC,
+    C,
+    S,
+    SparseTensor,
+    SparseTensorBuilder,
+    choose_structure,
+    intersect,
+    trace_construction,
+    union,
+)
+from sparsetensorviz._memory import PeakTracer
 
 
 def slow(param):
@@ -136,3 +149,884 @@ def test_rankN(N):
         arrays = st.arrays
         for index, arr in zip(indices, arrays):
             assert np.array_equal(index, arr)
+
+
+@pytest.mark.parametrize("structure", ["DC-DC-DC-S", "C-S-S-S", "S-C-DC-S", "C-DC-C-S"])
+def test_unsorted(indices1, structure):
+    indices = [np.array(index) for index in indices1]
+    expected = SparseTensor(indices, (2, 2, 2, 3), structure)
+    perm = np.random.default_rng(42).permutation(indices[0].size)
+    st = SparseTensor([index[perm] for index in indices], (2, 2, 2, 3), structure)
+    st._validate()
+    for index1, index2 in zip(expected._indices, st._indices):
+        assert np.array_equal(index1, index2)
+    for ptr1, ptr2 in zip(expected._pointers, st._pointers):
+        assert np.array_equal(ptr1, ptr2)
+    with pytest.raises(ValueError, match="Duplicate"):
+        SparseTensor([np.append(index, index[0]) for index in indices], (2, 2, 2, 3), structure)
+
+
+def test_assume_sorted(indices1):
+    expected = SparseTensor(indices1, structure="C-S-DC-S")
+    for check_sorted in [True, False]:
+        st = SparseTensor(
+            indices1, structure="C-S-DC-S", assume_sorted=True, check_sorted=check_sorted
+        )
+        st._validate()
+        for index1, index2 in zip(expected._indices, st._indices):
+            assert np.array_equal(index1, index2)
+        for ptr1, ptr2 in zip(expected._pointers, st._pointers):
+            assert np.array_equal(ptr1, ptr2)
+    reversed_indices = [index[::-1] for index in indices1]
+    with pytest.raises(ValueError, match="not sorted"):
+        SparseTensor(reversed_indices, assume_sorted=True)
+    # Only the third dimension is out of order
+    unsorted = [[0, 0, 0], [0, 1, 1], [1, 1, 0]]
+    with pytest.raises(ValueError, match="not sorted"):
+        SparseTensor(unsorted, assume_sorted=True)
+    with pytest.raises(ValueError, match="Duplicate"):
+        SparseTensor([[0, 1, 1], [2, 3, 3]], assume_sorted=True)
+
+
+def test_validate_coords(monkeypatch):
+    from sparsetensorviz import _build
+
+    monkeypatch.setattr(_build, "BLOCKSIZE", 3)
+    rows = np.array([0, 5, 1, 7, 2, 3, 2], np.int32)
+    cols = [4, 0, 2, 2, 9, 1, 3]
+    st = SparseTensor([rows, cols])
+    assert st.shape == (8, 10)
+    assert st._indices[-1].dtype == np.uint8
+    assert np.array_equal(st.arrays[0], np.sort(rows))
+    assert SparseTensor([rows, cols], [9, 11]).shape == (9, 11)
+    with pytest.raises(TypeError, match="list or tuple"):
+        SparseTensor(rows)
+    with pytest.raises(ValueError, match="At least one"):
+        SparseTensor([])
+    with pytest.raises(ValueError, match="single dimension"):
+        SparseTensor([[rows]])
+    with pytest.raises(ValueError, match="same size"):
+        SparseTensor([rows, cols[:-1]])
+    with pytest.raises(ValueError, match="integer dtype"):
+        SparseTensor([rows, np.array(cols, float)])
+    with pytest.raises(ValueError, match="positive"):
+        SparseTensor([rows, np.negative(cols)])
+    with pytest.raises(ValueError, match="greater than 0"):
+        SparseTensor([rows, cols], [8, 0])
+    with pytest.raises(ValueError, match="same length"):
+        SparseTensor([rows, cols], [8])
+    with pytest.raises(ValueError, match="out of bounds"):
+        SparseTensor([rows, cols], [8, 9])
+    with pytest.raises(ValueError, match="shape must be given"):
+        SparseTensor([np.array([], int)])
+
+
+@pytest.mark.parametrize("max_memory", [None, 0])
+def test_from_chunks(monkeypatch, max_memory):
+    from sparsetensorviz import _chunked
+
+    monkeypatch.setattr(_chunked, "MERGE_BLOCKSIZE", 4)
+    rng = np.random.default_rng(7)
+    shape = (5, 3, 6)
+    flat = rng.choice(np.prod(shape), 40, replace=False)
+    indices = np.unravel_index(flat, shape)
+    chunks = [[index[i : i + 7] for index in indices] for i in range(0, 40, 7)]
+    chunks.insert(2, [np.empty(0, int)] * 3)
+    for structure in ["DC-DC-S", "C-S-S", "S-C-S"]:
+        expected = SparseTensor(indices, shape, structure)
+        st = SparseTensor.from_chunks(iter(chunks), shape, structure, max_memory=max_memory)
+        st._validate()
+        for index1, index2 in zip(expected._indices, st._indices):
+            assert np.array_equal(index1, index2)
+        for ptr1, ptr2 in zip(expected._pointers, st._pointers):
+            assert np.array_equal(ptr1, ptr2)
+    chunks.append([index[:1] for index in indices])
+    with pytest.raises(ValueError, match="Duplicate"):
+        SparseTensor.from_chunks(chunks, shape, max_memory=max_memory)
+
+
+def test_workers():
+    rng = np.random.default_rng(3)
+    shape = (6, 5, 4)
+    flat = np.sort(rng.choice(np.prod(shape), 50, replace=False))
+    indices = np.unravel_index(flat, shape)
+    # Many duplicates of the first index make some partitions empty
+    indices[0][:30] = 0
+    indices = list(np.unravel_index(np.unique(np.ravel_multi_index(indices, shape)), shape))
+    shuffled = [index[::-1] for index in indices]
+    for structure in ["DC-DC-S", "C-C-S", "S-DC-S"]:
+        expected = SparseTensor(indices, shape, structure)
+        for st in [
+            SparseTensor(shuffled, shape, structure, workers=3),
+            SparseTensor(indices, shape, structure, workers=5, assume_sorted=True),
+        ]:
+            st._validate()
+            for index1, index2 in zip(expected._indices, st._indices):
+                assert index1.tobytes() == index2.tobytes()
+            for ptr1, ptr2 in zip(expected._pointers, st._pointers):
+                assert ptr1.tobytes() == ptr2.tobytes()
+    with pytest.raises(ValueError, match="not sorted"):
+        SparseTensor(shuffled, shape, workers=3, assume_sorted=True)
+    with pytest.raises(ValueError, match="Duplicate"):
+        SparseTensor([np.append(index, index[-1]) for index in indices], shape, workers=2)
+
+
+def test_no_copy(indices1):
+    expected = SparseTensor(indices1, structure="DC-C-S-S")
+    coords = np.array(indices1, np.int32).T
+    for arrays in [
+        coords,
+        np.asfortranarray(coords),
+        memoryview(coords),
+        [memoryview(np.ascontiguousarray(index)) for index in coords.T],
+    ]:
+        for assume_sorted in [False, True]:
+            st = SparseTensor(arrays, structure="DC-C-S-S", copy=False, assume_sorted=assume_sorted)
+            st._validate()
+            assert st.shape == expected.shape
+            for index1, index2 in zip(expected._indices, st._indices):
+                assert np.array_equal(index1, index2)
+            for ptr1, ptr2 in zip(expected._pointers, st._pointers):
+                assert np.array_equal(ptr1, ptr2)
+    # Inputs are not modified
+    assert np.array_equal(coords, np.array(indices1).T)
+    with pytest.raises(TypeError, match="2d array"):
+        SparseTensor(np.zeros((2, 3, 4), int))
+
+
+def test_dtypes():
+    rows = [0, 1, 299, 299]
+    cols = [5, 0, 2, 70000]
+    for structure in ["C-S", "DC-S", "S-S"]:
+        st = SparseTensor([rows, cols], structure=structure)
+        st._validate()
+        assert [index.dtype for index in st._indices] == [np.uint16, np.uint32]
+        assert [ptr.dtype for ptr in st._pointers] == [np.uint8]
+        assert st.get_index(0).dtype == np.uint16
+        assert st.get_pointers(0).dtype == np.uint8
+        assert [array.dtype for array in st.arrays] == [int, int]
+        assert np.array_equal(st.arrays[1], cols)
+    st = SparseTensor([rows, cols], structure="C-S", index_dtype=int, pointer_dtype=np.uint32)
+    assert [index.dtype for index in st._indices] == [int, int]
+    assert [ptr.dtype for ptr in st._pointers] == [np.uint32]
+    st = SparseTensor([[0, 1], [0, 255], [0, 256]], structure="C-C-S")
+    # The second level has 2 * 256 entries
+    assert [ptr.dtype for ptr in st._pointers] == [np.uint16, np.uint8]
+    st._validate()
+    with pytest.raises(ValueError, match="too small"):
+        SparseTensor([rows, cols], index_dtype=np.uint16)
+    with pytest.raises(ValueError, match="integer dtype"):
+        SparseTensor([rows, cols], pointer_dtype=float)
+
+
+@pytest.mark.parametrize("dtype", [float, complex, bool, np.int8])
+def test_values(indices1, dtype):
+    indices = [np.array(index) for index in indices1]
+    values = np.arange(indices[0].size).astype(dtype)
+    if dtype is complex:
+        values *= 1 - 1j
+    perm = np.random.default_rng(5).permutation(values.size)
+    shuffled = [index[perm] for index in indices]
+    for kwargs in [{}, {"workers": 2}]:
+        st = SparseTensor(shuffled, structure="DC-C-S-S", values=values[perm], **kwargs)
+        st._validate()
+        assert st.values.dtype == dtype
+        assert np.array_equal(st.values, values)
+    st2 = st.as_structure("S-S-DC-S")
+    st2._validate()
+    assert np.array_equal(st2.values, values)
+    assert np.array_equal(st.taco_view.values, values)
+    st3 = SparseTensor(indices, values=values, assume_sorted=True, copy=False)
+    assert np.shares_memory(st3.values, values)
+    assert SparseTensor(indices).values is None
+    with pytest.raises(ValueError, match="values must be"):
+        SparseTensor(indices, values=values[:-1])
+
+
+def test_value_fields(indices1):
+    indices = [np.array(index) for index in indices1]
+    perm = np.random.default_rng(11).permutation(indices[0].size)
+    count = np.arange(indices[0].size)
+    total = count * 1.5
+    st = SparseTensor(
+        [index[perm] for index in indices],
+        structure="S-DC-C-S",
+        values={"count": count[perm], "total": total[perm]},
+    )
+    st._validate()
+    assert st.fields == ("count", "total")
+    assert st.values.dtype["count"] == int
+    assert np.array_equal(st.values["count"], count)
+    assert np.array_equal(st.values["total"], total)
+    st2 = st.as_structure("DC-DC-DC-S")
+    assert st2.fields == ("count", "total")
+    assert np.array_equal(st2.values["total"], total)
+    st3 = SparseTensor(indices, values=st.values)
+    assert st3.fields == ("count", "total")
+    assert SparseTensor(indices, values=count).fields is None
+    assert SparseTensor(indices).fields is None
+    with pytest.raises(ValueError, match="values must be"):
+        SparseTensor(indices, values={"count": count, "total": total[:-1]})
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_duplicates(workers):
+    arrays = [np.array([1, 0, 1, 0, 1, 1]), np.array([2, 1, 0, 1, 2, 2])]
+    values = np.array([5.0, 1.0, 2.0, 3.0, 4.0, 6.0])
+    with pytest.raises(ValueError, match="Duplicate"):
+        SparseTensor(arrays, workers=workers)
+    with pytest.raises(ValueError, match="duplicates must be"):
+        SparseTensor(arrays, duplicates="mean")
+    expected = {
+        "sum": [4, 2, 15],
+        "min": [1, 2, 4],
+        "max": [3, 2, 6],
+        "first": [1, 2, 5],
+        "last": [3, 2, 6],
+        "count": [2, 1, 3],
+    }
+    for how, expect in expected.items():
+        st = SparseTensor(arrays, values=values, duplicates=how, workers=workers)
+        st._validate()
+        assert [x.tolist() for x in st.arrays] == [[0, 1, 1], [1, 0, 2]]
+        assert st.values.tolist() == expect
+    st = SparseTensor(arrays, duplicates="sum", workers=workers)
+    assert st.values is None
+    assert [x.tolist() for x in st.arrays] == [[0, 1, 1], [1, 0, 2]]
+    st = SparseTensor(arrays, values={"a": values, "b": -values}, duplicates="max", workers=workers)
+    assert st.values["a"].tolist() == [3, 2, 6]
+    assert st.values["b"].tolist() == [-1, -2, -4]
+    empty = np.empty(0, int)
+    st = SparseTensor([empty, empty], (2, 3), values=[], duplicates="sum", workers=workers)
+    assert st.values.size == 0
+
+
+@pytest.mark.parametrize("shape", [[2, 2, 2, 3], [3, 4, 3, 5]])
+def test_as_structure(indices1, shape):
+    structures = [
+        "".join(sparsity) + "S" for sparsity in itertools.product(["S", "C", "DC"], repeat=3)
+    ]
+    values = np.arange(len(indices1[0]))
+    for structure in structures:
+        st = SparseTensor(indices1, shape, structure, values=values)
+        for target in structures:
+            st2 = st.as_structure(target)
+            st2._validate()
+            expected = SparseTensor(indices1, shape, target)
+            for x, y in zip(st2._indices + st2._pointers, expected._indices + expected._pointers):
+                np.testing.assert_array_equal(x, y)
+            np.testing.assert_array_equal(st2.values, values)
+
+
+@pytest.mark.parametrize("structure", ["DC-DC-DC-S", "C-C-C-S", "S-C-DC-S", "C-S-C-S"])
+def test_to_coo(indices1, structure):
+    shape = [3, 4, 3, 5]
+    st = SparseTensor(indices1, shape, structure)
+    expected = SparseTensor(indices1, shape, "S-S-S-S")._indices
+    for array, index in zip(st.arrays, expected):
+        assert array.dtype == int
+        np.testing.assert_array_equal(array, index)
+    nnz = len(indices1[0])
+    out = [np.full(nnz, 7, np.uint8) for _ in range(4)]
+    assert st.to_coo(out=out) is out
+    for array, index in zip(out, expected):
+        np.testing.assert_array_equal(array, index)
+    out = np.empty((nnz, 4), np.int32)
+    assert st.taco_view.to_coo(out) is out
+    np.testing.assert_array_equal(out, np.stack(expected, axis=1))
+    with pytest.raises(ValueError, match="each dimension"):
+        st.to_coo(out=out[:, :3])
+    with pytest.raises(ValueError, match="nnz"):
+        st.to_coo(out=[np.empty(nnz + 1, int)] * 4)
+    with pytest.raises(ValueError, match="integer"):
+        st.to_coo(out=np.empty((nnz, 4)))
+    wide = SparseTensor([[0, 2], [5, 299]], (3, 300))
+    with pytest.raises(ValueError, match="can't hold size 300"):
+        wide.to_coo(out=np.empty((2, 2), np.uint8))
+    out = [np.empty(2, np.uint8), np.empty(2, np.uint16)]
+    assert [x.tolist() for x in wide.to_coo(out=out)] == [[0, 2], [5, 299]]
+
+
+def test_lazy(indices1):
+    shape = [3, 4, 3, 5]
+    expected = SparseTensor(indices1, shape, "S-C-DC-S")
+    st = SparseTensor(indices1, shape, "S-C-DC-S", lazy=True)
+    assert st.shape == (3, 4, 3, 5)
+    assert st.abbreviation == expected.abbreviation
+    assert st.taco_structure == expected.taco_structure
+    assert st._indices.computed == [False] * 4
+    assert st._pointers.computed == [False] * 3
+    np.testing.assert_array_equal(st.get_index(2), expected.get_index(2))
+    assert st._indices.computed == [False, False, True, False]
+    assert st.get_index(2) is st.get_index(-2)
+    np.testing.assert_array_equal(st.get_pointers(0), expected.get_pointers(0))
+    assert st._pointers.computed == [True, False, False]
+    assert st.indices[1] is None
+    assert st.pointers[0] is None
+    assert st._indices.computed == [True, False, True, True]
+    st._validate()
+    assert repr(st) == repr(expected)
+    st2 = st.as_structure("DC-DC-C-S")
+    assert st2._indices.computed == [False] * 4
+    for x, y in zip(st2.arrays, expected.arrays):
+        np.testing.assert_array_equal(x, y)
+
+
+def _stored_nbytes(st):
+    return sum(x.nbytes for x in st.indices + st.pointers if x is not None)
+
+
+@pytest.mark.parametrize("shape", [[2, 2, 2, 3], [3, 4, 3, 5], [300, 2, 2, 3]])
+def test_choose_structure(indices1, shape):
+    structures = [["S", "C", "DC"]] * 3
+    nbytes = {
+        "".join(sparsity)
+        + "S": _stored_nbytes(SparseTensor(indices1, shape, "".join(sparsity) + "S"))
+        for sparsity in itertools.product(*structures)
+    }
+    structure = choose_structure(indices1, shape)
+    assert _stored_nbytes(SparseTensor(indices1, shape, structure)) == min(nbytes.values())
+    st = SparseTensor(indices1, shape, "auto")
+    st._validate()
+    assert st.structure == structure
+    assert SparseTensor(indices1, shape, lazy=True).as_structure("auto").structure == structure
+
+
+def test_choose_structure_simple():
+    assert choose_structure([[0, 0, 0, 1, 1, 1], [0, 1, 2, 0, 1, 2]]) == [C, S]
+    assert choose_structure([[1], [2]], (1000, 1000)) == [S, S]
+    assert choose_structure([[1, 1], [2, 3]], (1000, 1000)) == [DC, S]
+    assert choose_structure([[1], [2]], (1000, 1000), pointer_dtype=np.uint8) == [S, S]
+    with pytest.raises(ValueError, match="too small"):
+        choose_structure([[1], [2]], (1000, 1000), index_dtype=np.uint8)
+
+
+def test_memory_usage(indices1):
+    shape = [3, 4, 3, 5]
+    values = np.arange(len(indices1[0]), dtype=np.float64)
+    st = SparseTensor(indices1, shape, "S-C-DC-S", values=values)
+    usage = st.memory_usage()
+    assert list(usage) == [
+        "indices_0",
+        "pointers_0",
+        "indices_1",
+        "pointers_1",
+        "indices_2",
+        "pointers_2",
+        "indices_3",
+        "values",
+    ]
+    assert [usage[f"indices_{i}"]["stored"] for i in range(4)] == [True, False, True, True]
+    assert [usage[f"pointers_{i}"]["stored"] for i in range(3)] == [False, True, True]
+    assert all(x["materialized"] for x in usage.values())
+    assert usage["indices_1"]["nbytes"] == st._indices[1].nbytes
+    assert usage["values"]["nbytes"] == values.nbytes
+    assert st.nbytes == sum(x["nbytes"] for x in usage.values())
+    assert st.taco_view.nbytes == st.nbytes
+    assert st.construction_peak is None
+
+    lazy = SparseTensor(indices1, shape, "S-C-DC-S", values=values, lazy=True)
+    lazy_usage = lazy.memory_usage()
+    assert not any(lazy_usage[key]["materialized"] for key in usage if key != "values")
+    for key, val in usage.items():
+        assert lazy_usage[key]["nbytes"] == val["nbytes"]
+        assert lazy_usage[key]["stored"] == val["stored"]
+    assert lazy.nbytes == values.nbytes + lazy_usage["csf"]["nbytes"]
+    lazy.get_index(1)
+    assert lazy.memory_usage()["indices_1"]["materialized"]
+
+
+@pytest.mark.skipif(not hasattr(tracemalloc, "reset_peak"), reason="requires Python 3.9")
+def test_construction_peak(indices1):
+    shape = [3, 4, 3, 5]
+    values = np.arange(len(indices1[0]))
+    with trace_construction():
+        st = SparseTensor(indices1, shape, "S-C-DC-S", values=values)
+        assert st.construction_peak >= st.nbytes
+        assert st.as_structure("C-C-C-S").construction_peak > 0
+    assert not tracemalloc.is_tracing()
+
+    # The peak isn't reset outside of trace_construction
+    tracemalloc.start()
+    try:
+        big = np.ones(10**6)
+        del big
+        peak = tracemalloc.get_traced_memory()[1]
+        st = SparseTensor(indices1, shape, "S-C-DC-S", values=values)
+        assert st.construction_peak is None
+        assert tracemalloc.get_traced_memory()[1] >= peak
+        with trace_construction():
+            # A nested construction doesn't lower the peak of an enclosing one
+            tracer = PeakTracer()
+            big = np.ones(10**6)
+            del big
+            st = SparseTensor(indices1, shape, "S-C-DC-S", values=values)
+            assert st.construction_peak < 10**6
+            assert tracer.stop() >= 8 * 10**6
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+
+def test_construction_peak_unsupported(indices1, monkeypatch):
+    # Peaks can't be measured without tracemalloc.reset_peak (Python < 3.9)
+    monkeypatch.delattr(tracemalloc, "reset_peak", raising=False)
+    with trace_construction():
+        st = SparseTensor(indices1, [3, 4, 3, 5])
+    assert st.construction_peak is None
+
+
+@pytest.mark.parametrize("structure", ["DC-DC-S", "C-C-S", "S-C-S", "C-DC-S", "S-S-S"])
+@pytest.mark.parametrize("lazy", [False, True])
+def test_insert(structure, lazy):
+    rng = np.random.default_rng(5)
+    shape = (4, 5, 6)
+    flat = rng.choice(np.prod(shape), 40, replace=False)
+    old, new = flat[:30], flat[30:]
+    st = SparseTensor(list(np.unravel_index(old, shape)), shape, structure, values=old, lazy=lazy)
+    # Includes a new coordinate twice and an existing coordinate
+    new = np.concatenate([new, new[:1], old[:1]])
+    new_values = np.arange(new.size) + 1000
+    with pytest.raises(ValueError, match="Duplicate"):
+        st.insert(list(np.unravel_index(new, shape)), new_values)
+    with pytest.raises(ValueError, match="values must be given"):
+        st.insert(list(np.unravel_index(new, shape)))
+    # The default policy inserts new coordinates with values
+    unique = SparseTensor(list(np.unravel_index(old, shape)), shape, structure, values=old)
+    unique.insert(list(np.unravel_index(new[:-2], shape)), new_values[:-2])
+    unique._validate()
+    expected = SparseTensor(
+        list(np.unravel_index(np.concatenate([old, new[:-2]]), shape)),
+        shape,
+        structure,
+        values=np.concatenate([old, new_values[:-2]]),
+    )
+    for x, y in zip(unique.arrays, expected.arrays):
+        np.testing.assert_array_equal(x, y)
+    np.testing.assert_array_equal(unique.values, expected.values)
+    st.insert(list(np.unravel_index(new, shape)), new_values, duplicates="last")
+    st._validate()
+    expected = SparseTensor(
+        list(np.unravel_index(np.concatenate([old, new]), shape)),
+        shape,
+        structure,
+        values=np.concatenate([old, new_values]),
+        duplicates="last",
+    )
+    assert st.structure == expected.structure
+    for x, y in zip([*st._indices, *st._pointers], expected._indices + expected._pointers):
+        np.testing.assert_array_equal(x, y)
+    np.testing.assert_array_equal(st.values, expected.values)
+
+    st = SparseTensor(list(np.unravel_index(old, shape)), shape, structure)
+    st.insert(list(np.unravel_index(new, shape)), duplicates="count")
+    expected = SparseTensor(
+        list(np.unravel_index(np.concatenate([old, new]), shape)),
+        shape,
+        structure,
+        duplicates="count",
+    )
+    for x, y in zip(st.arrays, expected.arrays):
+        np.testing.assert_array_equal(x, y)
+    np.testing.assert_array_equal(st.values, expected.values)
+
+
+@pytest.mark.parametrize(
+    "structure", ["DC-DC-S", "C-C-S", "S-C-S", "C-DC-S", "S-S-S", "DC-S-S", "S-DC-S"]
+)
+def test_append(structure):
+    rng = np.random.default_rng(7)
+    shape = (12, 4, 300)
+    flat = np.sort(rng.choice(np.prod(shape), 120, replace=False))
+    coords = np.stack(np.unravel_index(flat, shape), axis=1)
+    st = SparseTensor(coords[:10], shape, structure, values=flat[:10])
+    with pytest.raises(ValueError, match="values must be given"):
+        st.append(coords[10:20])
+    # Batches begin at the same leading index as the previous batch ends
+    for start, stop in [(10, 11), (11, 50), (50, 51), (51, 51), (51, 120)]:
+        st.append(coords[start:stop], flat[start:stop])
+        st._validate()
+        expected = SparseTensor(coords[:stop], shape, structure, values=flat[:stop])
+        for x, y in zip(st._indices + st._pointers, expected._indices + expected._pointers):
+            np.testing.assert_array_equal(x, y)
+            assert x.dtype == y.dtype
+        np.testing.assert_array_equal(st.values, flat[:stop])
+    with pytest.raises(ValueError, match="leading indices"):
+        st.append(coords[:1], flat[:1])
+    with pytest.raises(ValueError, match="Duplicate"):
+        st.append(coords[-1:], flat[-1:])
+    st.append(coords[-1:], flat[-1:], duplicates="sum")
+    assert st.values[-1] == 2 * flat[-1]
+    # Appending doesn't modify sub-tensors that share memory
+    sub = st[coords[-1, 0] :]
+    arrays = [array.copy() for array in sub.arrays]
+    values = sub.values.copy()
+    # Insert before existing coordinates so the shared range is rewritten
+    new = np.setdiff1d(np.arange(11 * 4 * 300, flat[-1]), flat)[:1]
+    st.append(list(np.unravel_index(new, shape)), new)
+    for x, y in zip(sub.arrays, arrays):
+        np.testing.assert_array_equal(x, y)
+    np.testing.assert_array_equal(sub.values, values)
+
+    st = SparseTensor(coords[:10], shape, structure)
+    st.append(coords[9:20], duplicates="count")
+    assert st.values.tolist() == [1] * 9 + [2] + [1] * 10
+    lazy = SparseTensor(coords[:10], shape, structure, lazy=True)
+    lazy.append(coords[10:])
+    for x, y in zip(lazy.arrays, expected.arrays):
+        np.testing.assert_array_equal(x, y)
+    lazy = SparseTensor(coords[:10], shape, structure, values=flat[:10], lazy=True)
+    lazy.append(coords[10:], flat[10:])
+    for x, y in zip(lazy.arrays, expected.arrays):
+        np.testing.assert_array_equal(x, y)
+    np.testing.assert_array_equal(lazy.values, flat)
+
+
+@pytest.mark.parametrize("duplicates", ["error", "sum", "last", "count"])
+def test_builder(duplicates):
+    rng = np.random.default_rng(3)
+    shape = (5, 6, 7)
+    coords = np.stack(np.unravel_index(rng.integers(0, 210, 2000), shape), axis=1)
+    if duplicates == "error":
+        coords = np.unique(coords, axis=0)[rng.permutation(len(np.unique(coords, axis=0)))]
+    values = rng.random(len(coords))
+    builder = SparseTensorBuilder(shape, dtype=float, duplicates=duplicates, capacity=4)
+    assert len(builder) == builder.capacity == builder.nbytes == 0
+    # Empty batches are fine before the buffers exist
+    builder.add(np.empty((0, 3), int), np.empty(0))
+    assert len(builder) == builder.capacity == 0
+    builder.add(coords[0], values[0])
+    for start in range(1, len(coords), 37):
+        builder.add(coords[start : start + 37], values[start : start + 37])
+    assert builder.capacity >= len(builder)
+    if duplicates == "error":
+        assert len(builder) == len(coords)
+        assert builder.capacity < 2 * len(coords)
+    else:
+        # Duplicates are combined instead of growing as often
+        assert builder.capacity < len(coords)
+    st = builder.freeze("DC-C-S")
+    st._validate()
+    assert len(builder) == 0
+    kwargs = {"duplicates": duplicates}
+    if duplicates != "count":
+        kwargs["values"] = values
+    expected = SparseTensor(list(coords.T), shape, "DC-C-S", **kwargs)
+    for x, y in zip(st.arrays, expected.arrays):
+        np.testing.assert_array_equal(x, y)
+    np.testing.assert_allclose(st.values, expected.values)
+
+    builder.add([[0, 0, 0]], 1.0)
+    assert builder.freeze().structure == [DC, DC, S]
+    assert SparseTensorBuilder(shape).freeze(lazy=True).arrays[0].size == 0
+    with pytest.raises(ValueError, match="out of bounds"):
+        builder.add([0, 6, 0], 1.0)
+    if duplicates != "count":
+        with pytest.raises(ValueError, match="values must be given"):
+            builder.add([0, 0, 0])
+
+
+@pytest.mark.parametrize("structure", ["DC-DC-DC-S", "C-C-C-S", "S-C-DC-S", "C-S-S-S", "DC-S-C-S"])
+def test_lookup(indices1, structure):
+    shape = (3, 4, 3, 5)
+    values = np.arange(len(indices1[0])) * 10
+    st = SparseTensor(indices1, shape, structure, values=values)
+    probes = np.stack(np.unravel_index(np.arange(np.prod(shape)), shape), axis=1)
+    stored = np.ravel_multi_index(indices1, shape)
+    expected = np.full(len(probes), -1)
+    expected[stored] = np.arange(len(stored))
+    np.testing.assert_array_equal(st.lookup(probes), expected)
+    assert st.lookup(list(probes[stored[3]])) == 3
+    assert st.lookup([2, 3, 2, 4]) == -1
+    assert st.lookup(np.empty((0, 4), int)).size == 0
+    gathered = st.gather(probes, fill_value=-1)
+    np.testing.assert_array_equal(gathered, np.where(expected >= 0, expected * 10, -1))
+    assert st.gather(probes[stored[2]]) == 20
+    with pytest.raises(ValueError, match="out of bounds"):
+        st.lookup([0, 0, 3, 0])
+    with pytest.raises(ValueError, match="shape"):
+        st.lookup([0, 0, 0])
+    with pytest.raises(ValueError, match="no values"):
+        SparseTensor(indices1, shape).gather(probes)
+
+
+@pytest.mark.parametrize(
+    "structure", ["DC-DC-DC-S", "C-C-C-S", "S-C-DC-S", "C-S-S-S", "DC-S-C-S", "DC-C-S-S"]
+)
+def test_getitem(indices1, structure):
+    shape = (3, 4, 3, 5)
+    values = np.arange(len(indices1[0]))
+    st = SparseTensor(indices1, shape, structure, values=values)
+    dense = np.full(shape, -1)
+    dense[tuple(indices1)] = values
+    keys = [
+        0,
+        1,
+        -2,
+        (1, slice(None), 2),
+        (1, 2),
+        (0, slice(1, 3)),
+        (..., 2),
+        (slice(None), 1, ..., slice(0, 5, 2)),
+        (slice(0, 2), slice(None, None, 2)),
+        (slice(None), slice(None), 0, 0),
+        (0, 0, 0),
+        # Prefixes that aren't stored
+        2,
+        (2, slice(1, 3)),
+        (0, 3),
+    ]
+    for key in keys:
+        sub = st[key]
+        expected = dense[key]
+        nonzero = np.nonzero(expected >= 0)
+        assert sub.shape == expected.shape
+        assert sub.ndim == len(nonzero)
+        for x, y in zip(sub.arrays, nonzero):
+            np.testing.assert_array_equal(x, y)
+        np.testing.assert_array_equal(sub.values, expected[nonzero])
+        fresh = SparseTensor(list(nonzero), sub.shape, sub.structure)
+        assert len(sub._indices) == len(fresh._indices)
+        for x, y in zip(sub._indices + sub._pointers, fresh._indices + fresh._pointers):
+            np.testing.assert_array_equal(x, y)
+        assert sub.lookup([0] * sub.ndim) == fresh.lookup([0] * sub.ndim)
+        if sub.values.size:
+            sub._validate()
+    # Slicing only leading dimensions shares memory
+    sub = st[1, 1:3]
+    assert np.shares_memory(sub._indices[-1], st._indices[-1])
+    assert np.shares_memory(sub.values, st.values)
+    lazy = SparseTensor(indices1, shape, structure, lazy=True)
+    for x, y in zip(lazy[1, 1:3].arrays, sub.arrays):
+        np.testing.assert_array_equal(x, y)
+    with pytest.raises(IndexError, match="at least one dimension"):
+        st[1, 2, 0, 1]
+    with pytest.raises(IndexError, match="negative steps"):
+        st[::-1]
+    with pytest.raises(IndexError, match="empty"):
+        st[2:1]
+    with pytest.raises(IndexError, match="out of bounds"):
+        st[3]
+    with pytest.raises(IndexError, match="too many"):
+        st[0, 0, 0, 0, 0]
+    with pytest.raises(IndexError, match="single ellipsis"):
+        st[..., 0, ...]
+    with pytest.raises(IndexError, match="only integers"):
+        st[None]
+    with pytest.raises(IndexError, match="only integers"):
+        st[True]
+    with pytest.raises(IndexError, match="only integers"):
+        st[0, np.False_]
+
+
+def test_transpose():
+    rng = np.random.default_rng(9)
+    shape = (3, 4, 300, 5)
+    flat = rng.choice(np.prod(shape), 200, replace=False)
+    arrays = list(np.unravel_index(flat, shape))
+    st = SparseTensor(arrays, shape, "DC-C-S-S", values=flat)
+    for axes in itertools.permutations(range(4)):
+        result = st.permute_dims(axes, "DC-DC-DC-S")
+        result._validate()
+        assert result.shape == tuple(shape[axis] for axis in axes)
+        expected = SparseTensor([arrays[axis] for axis in axes], result.shape, values=flat)
+        for x, y in zip(result._indices + result._pointers, expected._indices + expected._pointers):
+            np.testing.assert_array_equal(x, y)
+        np.testing.assert_array_equal(result.values, expected.values)
+    result = st.transpose()
+    assert result.structure == st.structure
+    assert result.shape == (5, 300, 4, 3)
+    np.testing.assert_array_equal(result.transpose().values, st.values)
+    assert st.transpose((0, -3, 2, 3)).values is not st.values
+    with pytest.raises(ValueError, match="axes"):
+        st.transpose((0, 1, 2))
+    with pytest.raises(ValueError, match="axes"):
+        st.transpose((0, 1, 2, 4))
+    # CSR to CSC
+    csr = SparseTensor([[0, 0, 1, 2, 2], [1, 3, 2, 0, 3]], (3, 4), "DC-S", values=[1, 2, 3, 4, 5])
+    csc = csr.transpose()
+    assert [x.tolist() for x in csc.arrays] == [[0, 1, 2, 3, 3], [2, 0, 1, 0, 2]]
+    assert csc.values.tolist() == [4, 1, 3, 2, 5]
+    # Indices wider than 16 bits are sorted in several digits
+    shape = (10**6, 3, 2**33)
+    arrays = [rng.integers(0, dimsize, 500) for dimsize in shape]
+    st = SparseTensor(arrays, shape, values=np.arange(500))
+    for axes in [(2, 0, 1), (1, 2, 0), (2, 1, 0)]:
+        result = st.permute_dims(axes)
+        coo = st.arrays
+        order = np.lexsort([coo[axis] for axis in axes][::-1])
+        for x, axis in zip(result.arrays, axes):
+            np.testing.assert_array_equal(x, coo[axis][order])
+        np.testing.assert_array_equal(result.values, st.values[order])
+
+
+@pytest.mark.parametrize("structure", ["DC-DC-S", "C-C-S", "S-C-S", "C-DC-S", "S-S-S"])
+def test_union_intersect(structure):
+    rng = np.random.default_rng(13)
+    shape = (4, 5, 6)
+    a_flat = np.sort(rng.choice(120, 50, replace=False))
+    b_flat = np.sort(rng.choice(120, 40, replace=False))
+    a = SparseTensor(list(np.unravel_index(a_flat, shape)), shape, structure, values=a_flat)
+    b = SparseTensor(list(np.unravel_index(b_flat, shape)), shape, "DC-DC-S", values=b_flat * 10)
+    for func, flat in [
+        (union, np.union1d(a_flat, b_flat)),
+        (intersect, np.intersect1d(a_flat, b_flat)),
+    ]:
+        result = func(a, b)
+        assert result.structure == a.structure
+        expected = SparseTensor(list(np.unravel_index(flat, shape)), shape, structure)
+        if flat.size:
+            result._validate()
+        for x, y in zip(result._indices + result._pointers, expected._indices + expected._pointers):
+            np.testing.assert_array_equal(x, y)
+        in_a = np.isin(flat, a_flat)
+        in_b = np.isin(flat, b_flat)
+        if func is union:
+            values = np.where(in_a, flat, 0) + np.where(in_b, flat * 10, 0)
+        else:
+            values = flat * flat * 10
+        np.testing.assert_array_equal(result.values, values)
+    result = union(a, b, np.maximum, structure="S-S-S")
+    assert result.structure == [S, S, S]
+    flat = np.union1d(a_flat, b_flat)
+    values = np.maximum(
+        np.where(np.isin(flat, a_flat), flat, 0), np.where(np.isin(flat, b_flat), flat * 10, 0)
+    )
+    np.testing.assert_array_equal(result.values, values)
+    assert union(a, SparseTensor(b.arrays, shape)).values is None
+    assert intersect(a, a).values.tolist() == (a_flat * a_flat).tolist()
+    fields = SparseTensor(a.arrays, shape, values={"x": a_flat, "y": -a_flat})
+    assert intersect(fields, fields).values["y"].tolist() == (a_flat * a_flat).tolist()
+    with pytest.raises(ValueError, match="shapes"):
+        union(a, SparseTensor(b.arrays, (4, 5, 7)))
+
+
+@pytest.mark.parametrize("structure", ["DC-DC-DC-S", "C-S-C-S", "S-DC-S-S"])
+def test_reductions(structure):
+    rng = np.random.default_rng(17)
+    shape = (3, 4, 5, 6)
+    flat = np.sort(rng.choice(np.prod(shape), 150, replace=False))
+    arrays = list(np.unravel_index(flat, shape))
+    values = rng.integers(-50, 50, flat.size).astype(np.int8)
+    st = SparseTensor(arrays, shape, structure, values=values)
+    dense = np.ma.masked_all(shape, np.int64)
+    dense[tuple(arrays)] = values
+    axes = [0, 3, -1, (1, 2), (0, 2), (2, 3), (1, 2, 3), (0, 1, 3)]
+    for axis in axes:
+        for name in ["sum", "count", "min", "max"]:
+            result = getattr(st, name)(axis)
+            if name == "count":
+                expected = dense.count(axis)
+                expected = np.ma.masked_equal(expected, 0)
+            else:
+                expected = getattr(dense, name)(axis)
+            nonzero = np.nonzero(~np.ma.getmaskarray(expected))
+            assert result.shape == expected.shape
+            for x, y in zip(result.arrays, nonzero):
+                np.testing.assert_array_equal(x, y)
+            np.testing.assert_array_equal(result.values, expected[nonzero].data)
+            result._validate()
+    assert st.sum(3).values.dtype == np.int64
+    assert st.max(3).values.dtype == np.int8
+    assert st.count() == flat.size
+    assert st.sum() == values.astype(int).sum()
+    assert st.min(axis=(0, 1, 2, 3)) == values.min()
+    # Reducing over no axes keeps every coordinate
+    for axis in [(), []]:
+        result = st.sum(axis)
+        assert result.structure == st.structure
+        for x, y in zip(result.arrays, arrays):
+            np.testing.assert_array_equal(x, y)
+        np.testing.assert_array_equal(result.values, values)
+        assert result.values.dtype == np.int64
+    assert st.max(()).values.dtype == np.int8
+    assert not np.shares_memory(st.max(()).values, st.values)
+    assert st.count(()).values.tolist() == [1] * flat.size
+    result = st.sum((0, 2), structure="C-S")
+    assert result.structure == [C, S]
+    with pytest.raises(ValueError, match="no values"):
+        SparseTensor(arrays, shape).sum(1)
+    with pytest.raises(ValueError, match="out of bounds"):
+        st.sum(4)
+    fields = SparseTensor(arrays, shape, values={"x": values, "y": flat})
+    expected = SparseTensor(arrays[:3], shape[:3], values=flat, duplicates="max")
+    np.testing.assert_array_equal(fields.max(3).values["y"], expected.values)
+    expected = SparseTensor(arrays[1:], shape[1:], values=flat, duplicates="max")
+    np.testing.assert_array_equal(fields.max(0).values["y"], expected.values)
+    # Sort instead of regrouping when the remaining dimensions are large
+    big = SparseTensor([[0, 1, 1], [9999999, 5, 9999999]], (2, 10**7), values=[1, 2, 3])
+    result = big.sum(0)
+    assert result.arrays[0].tolist() == [5, 9999999]
+    assert result.values.tolist() == [2, 4]
+    # The key space of the remaining dimensions doesn't fit in int64
+    huge = SparseTensor([[0, 1], [0, 1], [2, 2], [3, 3], [4, 5]], (2**16,) * 5, values=[1, 2])
+    result = huge.sum(np.int64(0))
+    assert result.arrays[-1].tolist() == [4, 5]
+    assert result.values.tolist() == [1, 2]
+    assert huge.sum((np.int64(0), np.int8(1))).values.tolist() == [1, 2]
+
+
+@pytest.mark.parametrize("structure", ["DC-DC-S", "C-C-S", "S-C-S", "S-S-S", "C-DC-S", "DC-S-S"])
+def test_fibers(structure):
+    arrays = [[0, 0, 0, 2, 2], [0, 0, 2, 1, 3], [1, 3, 0, 2, 2]]
+    shape = (3, 4, 5)
+    st = SparseTensor(arrays, shape, structure, lazy=structure.startswith("DC"))
+    coords = list(zip(*arrays))
+    prefixes, starts, stops = st.fibers(1)
+    assert len(prefixes) == 2
+    assert starts.base is not None and stops.base is not None
+    expected = []
+    for prefix, index in st.iter_fibers(-2, indices=True):
+        assert index.base is not None
+        expected.extend(prefix + (i,) for i in index.tolist())
+    assert expected == coords
+    fibers = list(st.iter_fibers(1))
+    assert len(fibers) == prefixes[0].size
+    rows = {prefix: stop - start for prefix, start, stop in st.iter_fibers(0)}
+    expected = {
+        "DC-DC-S": {(0,): 2, (2,): 2},
+        "C-C-S": {(0,): 4, (1,): 4, (2,): 4},
+        "C-DC-S": {(0,): 2, (1,): 0, (2,): 2},
+        "DC-S-S": {(0,): 3, (2,): 2},
+    }
+    if structure in expected:
+        assert rows == expected[structure]
+    else:
+        # Fibers below S levels have one entry each
+        assert all(stop - start == 1 for _, start, stop in st.iter_fibers(0))
+    assert st.taco_view.fibers(1)[0][1].tolist() == prefixes[1].tolist()
+    with pytest.raises(IndexError):
+        st.fibers(2)
+
+
+@pytest.mark.parametrize("structure", ["DC-DC-DC-S", "S-C-DC-S", "C-S-C-S"])
+def test_pickle(indices1, structure):
+    shape = [3, 4, 3, 5]
+    values = {"x": np.arange(len(indices1[0])), "y": np.ones(len(indices1[0]), np.float32)}
+    st = SparseTensor(indices1, shape, structure, values=values, group_indices=True)
+    lazy = SparseTensor(indices1, shape, structure, lazy=True)
+    for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+        for tensor in [st, lazy]:
+            rv = pickle.loads(pickle.dumps(tensor, protocol))
+            assert rv.structure == tensor.structure and rv.shape == tensor.shape
+            assert rv.group_indices == tensor.group_indices
+            assert repr(rv) == repr(tensor)
+            rv._validate()
+    # Level arrays and values are sent out-of-band
+    buffers = []
+    data = pickle.dumps(st, 5, buffer_callback=buffers.append)
+    assert len(buffers) == 2 * st.ndim
+    nbytes = sum(memoryview(buf).nbytes for buf in buffers)
+    assert len(pickle.dumps(st, 5)) >= len(data) + nbytes
+    rv = pickle.loads(data, buffers=buffers)
+    for x, y in zip(rv._indices + rv._pointers, st._indices + st._pointers):
+        assert x.dtype == y.dtype
+        np.testing.assert_array_equal(x, y)
+    assert rv.values.dtype == st.values.dtype
+    np.testing.assert_array_equal(rv.values, st.values)
+    rv = pickle.loads(pickle.dumps(lazy, 5))
+    assert rv._indices.computed == [False] * 4
+    for x, y in zip(rv.arrays, st.arrays):
+        np.testing.assert_array_equal(x, y)
+    view = pickle.loads(pickle.dumps(st.taco_view, 5))
+    assert repr(view) == repr(st.taco_view)